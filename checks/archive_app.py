@@ -0,0 +1,77 @@
+"""
+Reads the .conf files for the checks straight out of a .tgz/.spl app archive.
+
+splunk-appinspect extracts the whole archive to disk before running any check,
+even though these checks only ever read default/*.conf and local/*.conf. For
+vendor archives with large bundled binaries and lookups, that is most of the
+time spent. ArchiveApp streams through the archive once, keeping just those
+.conf files in memory, and has the same methods the checks use on
+splunk_appinspect.app.App, so it can be passed to any check_ function.
+
+    app = ArchiveApp("Splunk_TA_example.tgz")
+    check_regular_expressions.check_valid_regex_for_extract(app, reporter)
+"""
+import io
+import os
+import tarfile
+import regex as re
+from splunk_appinspect import configuration_parser
+from splunk_appinspect.configuration_file import ConfigurationFile
+
+
+class ArchiveApp:
+    """
+    An app backed by a .tgz/.spl archive, with only the default/*.conf and
+    local/*.conf members extracted, and only into memory.
+    """
+
+    # <app name>/<default or local>/<name>.conf, archives made with tar -C
+    # sometimes have a leading ./
+    member_pattern = re.compile(r"^(?:\./)?[^/]+/(?<dir>default|local)/(?<name>[^/]+\.conf)$")
+
+    def __init__(self, location):
+        self.location = location
+        self.conf_files = {}
+        self.app_conf_files = {}
+        # r|* reads the archive as a stream, so members we don't want are
+        # skipped over without being written anywhere or seeked back to
+        with tarfile.open(location, mode="r|*") as archive:
+            for member in archive:
+                m = self.member_pattern.match(member.name)
+                if m and member.isfile():
+                    self.conf_files[(m["dir"], m["name"])] = archive.extractfile(member).read()
+
+    def file_exists(self, *path_parts):
+        return tuple(os.path.join(*path_parts).split(os.sep)) in self.conf_files
+
+    def get_config_file_paths(self, config_file_name, basedir=["default", "local"]):
+        """
+        Same as App.get_config_file_paths, a dict of directory to config file
+        name, for the directories that have that config file.
+        """
+        config_file_paths = {}
+        for config_folder in basedir:
+            if self.file_exists(config_folder, config_file_name):
+                config_file_paths[config_folder] = config_file_name
+        return config_file_paths
+
+    def get_config(self, name, dir="default", config_file=None):
+        """
+        Parses the config file from memory with the same parser App uses, and
+        caches it like App does.
+        """
+        key = (dir, name)
+        if key not in self.app_conf_files:
+            if key not in self.conf_files:
+                raise IOError(f"No such conf file: {os.path.join(dir, name)}")
+            if config_file is None:
+                config_file = ConfigurationFile()
+            self.app_conf_files[key] = configuration_parser.parse(
+                io.BytesIO(self.conf_files[key]), config_file, configuration_parser.configuration_lexer)
+        return self.app_conf_files[key]
+
+    def props_conf(self, dir="default"):
+        return self.get_config("props.conf", dir=dir)
+
+    def transforms_conf(self, dir="default"):
+        return self.get_config("transforms.conf", dir=dir)
@@ -9,7 +9,8 @@ import splunk_appinspect
 import os
 import regex as re
 from splunk_appinspect.configuration_file import ConfigurationFile
-from .shared import ignorable, _cleanup_regex, _dynamic_field_names, _regex_valid, _regex_valid_for_property
+from .reference_graph import reference_graph
+from .shared import ignorable, _cleanup_regex, _dynamic_field_names, _regex_valid, _regex_valid_for_property, _unused_capture_groups
 
 
 @splunk_appinspect.tags("best_practices", "best_practices_regex", "best_practices_transforms")
@@ -24,7 +25,7 @@ def check_dynamic_field_names_transforms(app, reporter):
         for directory, filename in iter(config_file_paths.items()):
             file_path = os.path.join(directory, filename)
             config: ConfigurationFile = app.transforms_conf(directory)
-            for stanza in set(config.sections_with_setting_key_pattern(key_regex)):
+            for stanza in dict.fromkeys(config.sections_with_setting_key_pattern(key_regex)):
                 for setting in stanza.settings_with_key_pattern(key_regex):
                     _dynamic_field_names(setting, reporter, file_path)
 
@@ -41,11 +42,50 @@ def check_dynamic_field_names_props(app, reporter):
         for directory, filename in iter(config_file_paths.items()):
             file_path = os.path.join(directory, filename)
             config: ConfigurationFile = app.props_conf(directory)
-            for stanza in set(config.sections_with_setting_key_pattern(key_regex)):
+            for stanza in dict.fromkeys(config.sections_with_setting_key_pattern(key_regex)):
                 for setting in stanza.settings_with_key_pattern(key_regex):
                     _dynamic_field_names(setting, reporter, file_path)
 
 
+@splunk_appinspect.tags("best_practices", "best_practices_regex", "best_practices_transforms")
+@splunk_appinspect.cert_version(min="2.14.1")
+def check_unused_capture_groups_transforms(app, reporter):
+    """
+    Checks that REGEX and FORMAT map together in transforms.conf. Every $n in
+    FORMAT should be a capture group in REGEX, and every unnamed capture group
+    should be used by FORMAT, otherwise it could be non-capturing (?:...).
+    Also warns when named and unnamed capture groups are mixed.
+    """
+    key_regex = "^REGEX$"
+    config_file_paths = app.get_config_file_paths("transforms.conf")
+    if config_file_paths:
+        for directory, filename in iter(config_file_paths.items()):
+            file_path = os.path.join(directory, filename)
+            config: ConfigurationFile = app.transforms_conf(directory)
+            for stanza in dict.fromkeys(config.sections_with_setting_key_pattern(key_regex)):
+                format_setting = stanza.get_option("FORMAT") if stanza.has_option("FORMAT") else None
+                _unused_capture_groups(stanza.get_option("REGEX"), reporter, file_path, stanza,
+                                       format_setting=format_setting)
+
+
+@splunk_appinspect.tags("best_practices", "best_practices_regex", "best_practices_props")
+@splunk_appinspect.cert_version(min="2.14.1")
+def check_unused_capture_groups_props(app, reporter):
+    """
+    Checks for unnamed capture groups in EXTRACT in props.conf. Only named
+    capture groups create fields, so these could be non-capturing (?:...).
+    """
+    key_regex = "^EXTRACT-"
+    config_file_paths = app.get_config_file_paths("props.conf")
+    if config_file_paths:
+        for directory, filename in iter(config_file_paths.items()):
+            file_path = os.path.join(directory, filename)
+            config: ConfigurationFile = app.props_conf(directory)
+            for stanza in dict.fromkeys(config.sections_with_setting_key_pattern(key_regex)):
+                for setting in stanza.settings_with_key_pattern(key_regex):
+                    _unused_capture_groups(setting, reporter, file_path, stanza)
+
+
 @splunk_appinspect.tags("best_practices", "best_practices_props")
 @splunk_appinspect.cert_version(min="2.14.1")
 def check_duplicate_extract(app, reporter):
@@ -60,7 +100,7 @@ def check_duplicate_extract(app, reporter):
             file_path = os.path.join(directory, filename)
             config: ConfigurationFile = app.props_conf(directory)
             regexes = {}
-            for stanza in set(config.sections_with_setting_key_pattern(key_regex)):
+            for stanza in dict.fromkeys(config.sections_with_setting_key_pattern(key_regex)):
                 for setting in stanza.settings_with_key_pattern(key_regex):
                     # Clean up regex to find effectively the same regex.
                     regex = _cleanup_regex(setting.value)
@@ -89,7 +129,7 @@ def check_duplicate_transforms_regex(app, reporter):
             file_path = os.path.join(directory, filename)
             config: ConfigurationFile = app.transforms_conf(directory)
             regexes = {}
-            for stanza in set(config.sections_with_setting_key_pattern(key_regex)):
+            for stanza in dict.fromkeys(config.sections_with_setting_key_pattern(key_regex)):
                 for setting in stanza.settings_with_key_pattern(key_regex):
                     # Clean up regex to find effectively the same regex.
                     regex = _cleanup_regex(setting.value)
@@ -122,20 +162,10 @@ def check_extract_duplicates_transforms(app, reporter):
     transforms.conf
     """
     props_key_regex_pattern = "EXTRACT-"
-    transforms_key_regex_pattern = "^REGEX$"
     props_file_paths = app.get_config_file_paths("props.conf")
     transforms_file_paths = app.get_config_file_paths("transforms.conf")
-    transforms_regexes = {}
     if props_file_paths and transforms_file_paths:
-        for directory, filename in iter(transforms_file_paths.items()):
-            transforms_config: ConfigurationFile = app.transforms_conf(
-                directory)
-            transforms_extract_sections = set(
-                transforms_config.sections_with_setting_key_pattern(transforms_key_regex_pattern))
-            for stanza in transforms_extract_sections:
-                regex = _cleanup_regex(stanza.get_option("REGEX").value)
-                # there can be duplicates, but we check for those elsewhere
-                transforms_regexes[regex] = stanza
+        transforms_regexes = reference_graph(app).transforms_by_regex()
         for directory, filename in iter(props_file_paths.items()):
             file_path = os.path.join(directory, filename)
             props_config: ConfigurationFile = app.props_conf(directory)
@@ -179,7 +209,7 @@ def check_valid_regex_sedcmd(app, reporter):
                 """,
                 re.VERBOSE
             )
-            for stanza in set(config.sections_with_setting_key_pattern(key_regex)):
+            for stanza in dict.fromkeys(config.sections_with_setting_key_pattern(key_regex)):
                 for setting in stanza.settings_with_key_pattern(key_regex):
                     m = pattern.match(setting.value)
                     if not m:
@@ -205,7 +235,7 @@ def check_valid_regex_sedcmd(app, reporter):
                             # what about e and p?
                             # w is for a file, so not supported
                             _regex_valid(setting, reporter,
-                                         file_path, regex=search)
+                                         file_path, regex=search, stanza=stanza)
 
 
 @splunk_appinspect.tags("best_practices", "best_practices_regex", "best_practices_transforms")
@@ -220,8 +250,8 @@ def check_valid_regex_for_transforms(app, reporter):
         for directory, filename in iter(config_file_paths.items()):
             file_path = os.path.join(directory, filename)
             config: ConfigurationFile = app.transforms_conf(directory)
-            for stanza in set(config.sections_with_setting_key_pattern(key_regex)):
-                _regex_valid(stanza.get_option("REGEX"), reporter, file_path)
+            for stanza in dict.fromkeys(config.sections_with_setting_key_pattern(key_regex)):
+                _regex_valid(stanza.get_option("REGEX"), reporter, file_path, stanza=stanza)
 
 
 @splunk_appinspect.tags("best_practices", "best_practices_regex", "best_practices_props")
@@ -0,0 +1,213 @@
+"""
+Best practice checks for search time settings in props.conf, that slow down
+every search on a sourcetype.
+
+Each warning has the estimated relative cost of the setting, and of all the
+search time settings in the stanza, relative to a single EXTRACT:
+
+    KV_MODE = none             0
+    KV_MODE = auto (default)   2
+    KV_MODE = json / xml       3
+    EXTRACT-                   1 each
+    REPORT-                    1 per transform
+    LOOKUP-                    5 each
+    EVAL-                      0.5 each
+    FIELDALIAS-                0.1 each
+
+https://docs.splunk.com/Documentation/Splunk/latest/Admin/Propsconf
+https://docs.splunk.com/Documentation/Splunk/latest/Search/Writebettersearches
+"""
+import splunk_appinspect
+import fnmatch
+import os
+import regex as re
+from splunk_appinspect.configuration_file import ConfigurationFile
+from splunk_appinspect.splunk import normalizeBoolean
+from .shared import ignorable
+
+KV_MODE_COSTS = {"none": 0, "auto": 2, "auto_escaped": 2, "multi": 2, "json": 3, "xml": 3}
+EXTRACT_COST = 1
+REPORT_COST = 1
+LOOKUP_COST = 5
+EVAL_COST = 0.5
+FIELDALIAS_COST = 0.1
+
+
+def _kv_mode(stanza):
+    if stanza.has_option("KV_MODE"):
+        return stanza.get_option("KV_MODE").value.strip().lower()
+    return "auto"
+
+
+def _setting_cost(setting):
+    name = setting.name.upper()
+    if name == "KV_MODE":
+        return KV_MODE_COSTS.get(setting.value.strip().lower(), KV_MODE_COSTS["auto"])
+    if name.startswith("EXTRACT-"):
+        return EXTRACT_COST
+    if name.startswith("REPORT-"):
+        return REPORT_COST * len([t for t in setting.value.split(",") if t.strip()])
+    if name.startswith("LOOKUP-"):
+        return LOOKUP_COST
+    if name.startswith("EVAL-"):
+        return EVAL_COST
+    if name.startswith("FIELDALIAS-"):
+        return FIELDALIAS_COST
+    return 0
+
+
+def _stanza_cost(stanza):
+    """
+    Estimated relative cost of all the search time settings in the stanza.
+    """
+    cost = sum(_setting_cost(setting) for setting in stanza.settings())
+    if not stanza.has_option("KV_MODE"):
+        cost += KV_MODE_COSTS["auto"]
+    cost = round(cost, 1)
+    return int(cost) if float(cost).is_integer() else cost
+
+
+@splunk_appinspect.tags("best_practices", "best_practices_search", "best_practices_props")
+@splunk_appinspect.cert_version(min="2.14.1")
+def check_kv_mode_duplicates_extract(app, reporter):
+    """
+    Checks for EXTRACT regexes that extract key=value (KV_MODE = auto, the
+    default) or "key": value (KV_MODE = json) fields that automatic key value
+    extraction already extracts, so they are extracted twice.
+    """
+    config_file_paths = app.get_config_file_paths("props.conf")
+    for directory, filename in iter(config_file_paths.items()):
+        file_path = os.path.join(directory, filename)
+        props_config: ConfigurationFile = app.props_conf(directory)
+        for stanza in props_config.sections():
+            kv_mode = _kv_mode(stanza)
+            if kv_mode not in ("auto", "auto_escaped", "json"):
+                continue
+            separator = ":" if kv_mode == "json" else "="
+            for setting in stanza.settings_with_key_pattern("^EXTRACT-"):
+                try:
+                    pattern = re.compile(setting.value)
+                except re.error:
+                    # Invalid regexes are reported by check_valid_regex_for_extract
+                    continue
+                fields = []
+                for field in pattern.groupindex:
+                    if re.match(r"_(?:KEY|VAL)_", field):
+                        continue
+                    # The field name as a literal just before its capture group,
+                    # like user=(?<user>\w+) or "user":\s*"(?<user>[^"]+)
+                    key_value = rf"{re.escape(field)}[^()]{{0,12}}?{re.escape(separator)}[^()]{{0,12}}?\(\?P?<{re.escape(field)}>"
+                    if re.search(key_value, setting.value, re.IGNORECASE):
+                        fields.append(field)
+                if fields and not ignorable(setting, ("kv_mode", "search_performance"), stanza=stanza, config=props_config):
+                    output = (f"{setting.name} extracts {', '.join(fields)} which KV_MODE = {kv_mode} already extracts "
+                              f"for [{stanza.name}], estimated relative cost {_setting_cost(setting)} of {_stanza_cost(stanza)}")
+                    reporter.warn(output, file_path, setting.lineno)
+
+
+@splunk_appinspect.tags("best_practices", "best_practices_search", "best_practices_props")
+@splunk_appinspect.cert_version(min="2.14.1")
+def check_indexed_extractions_kv_mode(app, reporter):
+    """
+    Checks that KV_MODE = none with INDEXED_EXTRACTIONS, and also
+    AUTO_KV_JSON = false for json, otherwise the fields are extracted again at
+    search time.
+    """
+    config_file_paths = app.get_config_file_paths("props.conf")
+    for directory, filename in iter(config_file_paths.items()):
+        file_path = os.path.join(directory, filename)
+        props_config: ConfigurationFile = app.props_conf(directory)
+        for stanza in props_config.sections():
+            if not stanza.has_option("INDEXED_EXTRACTIONS"):
+                continue
+            setting = stanza.get_option("INDEXED_EXTRACTIONS")
+            if ignorable(setting, ("indexed_extractions", "search_performance"), stanza=stanza, config=props_config):
+                continue
+            kv_mode = _kv_mode(stanza)
+            if kv_mode != "none":
+                output = (f"KV_MODE = {kv_mode} with INDEXED_EXTRACTIONS = {setting.value} extracts fields twice "
+                          f"for [{stanza.name}], estimated relative cost {KV_MODE_COSTS.get(kv_mode, KV_MODE_COSTS['auto'])} "
+                          f"of {_stanza_cost(stanza)}")
+                reporter.warn(output, file_path, setting.lineno)
+            if setting.value.strip().lower() == "json" and (
+                    not stanza.has_option("AUTO_KV_JSON") or normalizeBoolean(stanza.get_option("AUTO_KV_JSON").value)):
+                output = f"AUTO_KV_JSON is not false with INDEXED_EXTRACTIONS = json for [{stanza.name}]"
+                reporter.warn(output, file_path, setting.lineno)
+
+
+@splunk_appinspect.tags("best_practices", "best_practices_search", "best_practices_props")
+@splunk_appinspect.cert_version(min="2.14.1")
+def check_automatic_lookups(app, reporter):
+    """
+    Checks for automatic LOOKUP- settings, which run on every search of the
+    sourcetype. Warns for sourcetypes in BEST_PRACTICES_HIGH_VOLUME_SOURCETYPES
+    (comma separated, wildcards allowed), and for any stanza with at least
+    BEST_PRACTICES_MAX_LOOKUPS (default 3) of them.
+    """
+    high_volume = [s.strip() for s in os.environ.get("BEST_PRACTICES_HIGH_VOLUME_SOURCETYPES", "").split(",") if s.strip()]
+    max_lookups = int(os.environ.get("BEST_PRACTICES_MAX_LOOKUPS", 3))
+    config_file_paths = app.get_config_file_paths("props.conf")
+    for directory, filename in iter(config_file_paths.items()):
+        file_path = os.path.join(directory, filename)
+        props_config: ConfigurationFile = app.props_conf(directory)
+        for stanza in props_config.sections():
+            lookups = list(stanza.settings_with_key_pattern("^LOOKUP-"))
+            if not lookups:
+                continue
+            if any(fnmatch.fnmatchcase(stanza.name, pattern) for pattern in high_volume):
+                for setting in lookups:
+                    if not ignorable(setting, ("automatic_lookup", "search_performance"), stanza=stanza, config=props_config):
+                        output = (f"{setting.name} is an automatic lookup on high volume [{stanza.name}], "
+                                  f"estimated relative cost {LOOKUP_COST} of {_stanza_cost(stanza)}")
+                        reporter.warn(output, file_path, setting.lineno)
+            elif len(lookups) >= max_lookups:
+                if not ignorable(stanza, ("automatic_lookup", "search_performance"), config=props_config):
+                    output = (f"{len(lookups)} automatic lookups for [{stanza.name}], "
+                              f"estimated relative cost {LOOKUP_COST * len(lookups)} of {_stanza_cost(stanza)}")
+                    reporter.warn(output, file_path, stanza.lineno)
+
+
+@splunk_appinspect.tags("best_practices", "best_practices_search", "best_practices_props")
+@splunk_appinspect.cert_version(min="2.14.1")
+def check_eval_chains(app, reporter):
+    """
+    Checks for EVAL- settings that use a field from another EVAL- in the same
+    stanza. Calculated fields are evaluated independently, so this does not do
+    what it looks like it does. Also checks for stanzas with at least
+    BEST_PRACTICES_MAX_EVALS (default 10) EVAL- settings.
+    """
+    max_evals = int(os.environ.get("BEST_PRACTICES_MAX_EVALS", 10))
+    config_file_paths = app.get_config_file_paths("props.conf")
+    for directory, filename in iter(config_file_paths.items()):
+        file_path = os.path.join(directory, filename)
+        props_config: ConfigurationFile = app.props_conf(directory)
+        for stanza in props_config.sections():
+            evals = list(stanza.settings_with_key_pattern("^EVAL-"))
+            if not evals:
+                continue
+            eval_fields = {setting.name[len("EVAL-"):] for setting in evals}
+            for setting in evals:
+                field = setting.name[len("EVAL-"):]
+                used = sorted((_eval_fields(setting.value) & eval_fields) - {field})
+                if used and not ignorable(setting, ("eval_chain", "search_performance"), stanza=stanza, config=props_config):
+                    output = (f"{setting.name} uses {', '.join(used)} from other EVAL- settings for [{stanza.name}], "
+                              f"which are not calculated yet")
+                    reporter.warn(output, file_path, setting.lineno)
+            if len(evals) >= max_evals:
+                if not ignorable(stanza, ("eval_chain", "search_performance"), config=props_config):
+                    output = (f"{len(evals)} EVAL- settings for [{stanza.name}], "
+                              f"estimated relative cost {EVAL_COST * len(evals)} of {_stanza_cost(stanza)}")
+                    reporter.warn(output, file_path, stanza.lineno)
+
+
+def _eval_fields(expression):
+    """
+    The field names used in an eval expression, leaving out strings and
+    function names. 'quoted field names' are included.
+    """
+    fields = set(re.findall(r"'((?:[^'\\]|\\.)+)'", expression))
+    expression = re.sub(r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'', " ", expression)
+    for m in re.finditer(r"(?<![\w.])([A-Za-z_][\w.]*+)(?!\s*\()", expression):
+        if m.group(1).upper() not in ("AND", "OR", "NOT", "XOR", "LIKE", "TRUE", "FALSE", "NULL"):
+            fields.add(m.group(1))
+    return fields
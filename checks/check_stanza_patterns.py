@@ -0,0 +1,36 @@
+"""
+Best practice checks for the [source::...] and [host::...] stanza patterns in
+props.conf.
+
+A source or host that matches several stanzas pays for the settings of all of
+them, and when they set the same setting only the one that takes precedence
+wins, which is easy to get wrong. See stanza_matcher.py for the pattern syntax
+and precedence.
+
+https://docs.splunk.com/Documentation/Splunk/latest/Admin/Propsconf
+"""
+import splunk_appinspect
+from .shared import ignorable
+from .stanza_matcher import stanza_matchers
+
+
+@splunk_appinspect.tags("best_practices", "best_practices_props")
+@splunk_appinspect.cert_version(min="2.14.1")
+def check_overlapping_stanza_patterns(app, reporter):
+    """
+    Checks for source:: and host:: stanzas whose patterns overlap, so some
+    sources or hosts match more than one of them. Each overlap is reported at
+    the stanza with lower precedence, with an example they both apply to.
+    """
+    if not app.get_config_file_paths("props.conf"):
+        return
+    source_matcher, host_matcher, locations = stanza_matchers(app)
+    for matcher in (source_matcher, host_matcher):
+        for (name, other, example) in matcher.overlaps():
+            file_path, stanza = locations[name]
+            if ignorable(stanza, "overlapping_stanza") or ignorable(locations[other][1], "overlapping_stanza"):
+                continue
+            output = f"[{name}] overlaps [{other}], which takes precedence"
+            if example is not None:
+                output += f", both apply to {example}"
+            reporter.warn(output, file_path, stanza.lineno)
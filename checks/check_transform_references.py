@@ -0,0 +1,97 @@
+"""
+Best practice checks for the references from props.conf REPORT-, TRANSFORMS-
+and RULESET- settings to transforms.conf.
+
+Index time transforms, from TRANSFORMS- and RULESET-, run on every event of
+every sourcetype that references them, so a transform used by many sourcetypes
+is where tuning its regex pays off the most. These are ranked by their total
+regex complexity, the complexity of the REGEX (see _regex_complexity in
+shared.py) times the number of props.conf stanzas that use it.
+
+https://docs.splunk.com/Documentation/Splunk/latest/Admin/Propsconf
+https://docs.splunk.com/Documentation/Splunk/latest/Admin/Transformsconf
+"""
+import splunk_appinspect
+import fnmatch
+import os
+from .reference_graph import INDEX_TIME_KINDS, reference_graph
+from .shared import ignorable, _regex_complexity
+
+# How many of the stanzas using a hot transform are named in the warning
+LISTED_STANZAS = 5
+
+
+@splunk_appinspect.tags("best_practices", "best_practices_transforms", "best_practices_props")
+@splunk_appinspect.cert_version(min="2.14.1")
+def check_dangling_transform_references(app, reporter):
+    """
+    Checks that every transform named in REPORT-, TRANSFORMS- and RULESET-
+    settings is in transforms.conf. Set BEST_PRACTICES_EXTERNAL_TRANSFORMS to a
+    comma separated list of transforms (wildcards allowed) that are defined in
+    another app.
+    """
+    external = [s.strip() for s in os.environ.get("BEST_PRACTICES_EXTERNAL_TRANSFORMS", "").split(",") if s.strip()]
+    if not app.get_config_file_paths("props.conf"):
+        return
+    for reference in reference_graph(app).dangling():
+        if any(fnmatch.fnmatchcase(reference.name, pattern) for pattern in external):
+            continue
+        if not ignorable(reference.setting, "dangling_transform", stanza=reference.stanza):
+            output = f"[{reference.stanza.name}]:{reference.setting.name} references {reference.name}, which is not in transforms.conf"
+            reporter.warn(output, reference.file_path, reference.setting.lineno)
+
+
+@splunk_appinspect.tags("best_practices", "best_practices_transforms", "best_practices_props")
+@splunk_appinspect.cert_version(min="2.14.1")
+def check_unreferenced_transforms(app, reporter):
+    """
+    Checks for transforms with REGEX, DELIMS or INGEST_EVAL that no REPORT-,
+    TRANSFORMS- or RULESET- in props.conf references. These are parsed and
+    loaded for nothing. Lookup definitions are left out, since they are used
+    from searches.
+    """
+    if not app.get_config_file_paths("transforms.conf"):
+        return
+    for transform in reference_graph(app).unreferenced():
+        file_path, stanza, setting = transform.location()
+        if not ignorable(setting or stanza, "unreferenced_transform", stanza=stanza):
+            output = f"Transform [{transform.name}] is not referenced by any REPORT-, TRANSFORMS- or RULESET- in props.conf"
+            reporter.warn(output, file_path, (setting or stanza).lineno)
+
+
+@splunk_appinspect.tags("best_practices", "best_practices_transforms", "best_practices_props")
+@splunk_appinspect.cert_version(min="2.14.1")
+def check_hot_index_time_transforms(app, reporter):
+    """
+    Checks for index time transforms that at least
+    BEST_PRACTICES_HOT_TRANSFORM_STANZAS (default 5) props.conf stanzas
+    reference with TRANSFORMS- or RULESET-, and reports them ranked by total
+    regex complexity, so the ones most worth tuning come first. Only the first
+    LISTED_STANZAS of the stanzas are named, the rest are in the reference
+    graph.
+    """
+    min_stanzas = int(os.environ.get("BEST_PRACTICES_HOT_TRANSFORM_STANZAS", 5))
+    if not app.get_config_file_paths("transforms.conf"):
+        return
+    graph = reference_graph(app)
+    hot = []
+    for (name, transform) in graph.transforms.items():
+        stanzas = graph.stanzas_using(name, kinds=INDEX_TIME_KINDS)
+        if len(stanzas) < min_stanzas:
+            continue
+        file_path, stanza, setting = transform.location()
+        if ignorable(setting or stanza, "hot_transform", stanza=stanza):
+            continue
+        complexity = 0
+        if "REGEX" in transform.settings:
+            complexity = _regex_complexity(transform.settings["REGEX"][2].value) or 0
+        hot.append((complexity * len(stanzas), complexity, stanzas, transform))
+    hot.sort(key=lambda h: -h[0])
+    for (rank, (total, complexity, stanzas, transform)) in enumerate(hot, 1):
+        file_path, stanza, setting = transform.location()
+        listed = ", ".join(stanzas[:LISTED_STANZAS])
+        if len(stanzas) > LISTED_STANZAS:
+            listed += f" and {len(stanzas) - LISTED_STANZAS} more"
+        output = (f"Index time transform [{transform.name}] is used by {len(stanzas)} props.conf stanzas "
+                  f"({listed}), regex complexity {complexity}, total {total}, rank {rank} of {len(hot)}")
+        reporter.warn(output, file_path, (setting or stanza).lineno)
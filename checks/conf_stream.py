@@ -0,0 +1,136 @@
+"""
+Streaming parser for .conf files.
+
+Some props.conf and transforms.conf files are generated, and run to hundreds of
+thousands of lines. Parsing them into a ConfigurationFile keeps every stanza,
+setting and header comment in memory for the whole run. ConfStream reads the
+file a line at a time and yields small ConfSetting records instead, so memory
+is bounded by the longest stanza header or setting, not the file.
+
+It follows the splunk_appinspect configuration parser, so header comments and
+line numbers are the same as on a ConfigurationFile, with a couple of
+differences:
+
+- Repeated stanzas and settings are all yielded, where a ConfigurationFile
+  keeps only the last one.
+- A file without a trailing newline still has the header comments of the last
+  stanza or setting, and a line continuation on the last line is kept.
+"""
+import io
+import sys
+import regex as re
+
+
+class ConfStanza:
+    """
+    A stanza, without its settings. Every ConfSetting in the stanza refers to
+    the same ConfStanza.
+    """
+
+    __slots__ = ("name", "lineno", "header")
+
+    def __init__(self, name, lineno, header):
+        self.name = name
+        self.lineno = lineno
+        self.header = header
+
+
+class ConfSetting:
+    """
+    A setting in a stanza, with the same name, value, lineno and header as a
+    ConfigurationSetting, so it can be used with ignorable.
+    """
+
+    __slots__ = ("name", "value", "lineno", "header", "stanza")
+
+    def __init__(self, name, value, lineno, header, stanza):
+        self.name = name
+        self.value = value
+        self.lineno = lineno
+        self.header = header
+        self.stanza = stanza
+
+
+class ConfStream:
+    """
+    Iterates over the settings of a .conf file, given as a path or a binary
+    file object, without keeping the file in memory. The comments before the
+    first stanza are in headers once iteration has started, like
+    ConfigurationFile.headers.
+    """
+
+    comment_pattern = re.compile(r"^\s*[#;]")
+    stanza_pattern = re.compile(r"^\s*\[")
+    setting_pattern = re.compile(r"^\s*\S*\s*=")
+    continuation_pattern = re.compile(r"\\\s*$")
+
+    def __init__(self, file):
+        self.file = file
+        self.headers = []
+
+    def _lines(self):
+        """
+        Yields each logical line, with continuations joined by a newline like
+        the appinspect parser, and the line number it ends on.
+        """
+        if isinstance(self.file, (str, bytes)) or hasattr(self.file, "__fspath__"):
+            fh = open(self.file, "rb")
+        else:
+            fh = self.file
+        text = io.TextIOWrapper(fh, encoding="utf-8-sig", errors="ignore", newline="")
+        try:
+            current = ""
+            lineno = 0
+            for line in text:
+                line = line.rstrip("\r\n")
+                lineno += 1
+                if self.continuation_pattern.search(line):
+                    current += line[:-1] + "\n"
+                else:
+                    yield current + line, lineno
+                    current = ""
+            if current:
+                # A continuation on the last line has nothing to join on to
+                yield current.rstrip("\n"), lineno
+        finally:
+            if fh is self.file:
+                # Don't close a file object we were given
+                text.detach()
+            else:
+                text.close()
+
+    def settings(self, key_pattern=None, case_sensitive=False):
+        """
+        Yields a ConfSetting for every setting, or just those whose name
+        matches key_pattern, the same as sections_with_setting_key_pattern.
+        """
+        if key_pattern is not None:
+            key_pattern = re.compile(key_pattern, 0 if case_sensitive else re.IGNORECASE)
+        headers = []
+        stanza = None
+        for line, lineno in self._lines():
+            if line == "" or line.isspace():
+                headers.append("")
+            elif self.comment_pattern.match(line):
+                headers.append(line.lstrip())
+            elif self.stanza_pattern.match(line) and line.rfind("]") > line.index("["):
+                if stanza is None:
+                    self.headers = headers
+                    headers = []
+                start = line.index("[")
+                stanza = ConfStanza(sys.intern(line[start + 1:line.rindex("]")]), lineno, tuple(headers))
+                headers = []
+            elif self.setting_pattern.match(line):
+                if stanza is None:
+                    self.headers = headers
+                    headers = []
+                    stanza = ConfStanza("default", lineno, ())
+                key, value = line.split("=", 1)
+                key = sys.intern(key.strip())
+                if key_pattern is None or key_pattern.search(key):
+                    yield ConfSetting(key, value.strip(), lineno, tuple(headers), stanza)
+                headers = []
+            else:
+                headers.append(line)
+        if stanza is None:
+            self.headers = headers
@@ -0,0 +1,169 @@
+"""
+Index of the references from props.conf to transforms.conf in an app.
+
+props.conf REPORT- (search time), and TRANSFORMS- and RULESET- (index time)
+settings name transforms.conf stanzas, comma separated. ReferenceGraph resolves
+those once per app, indexed both ways, so checks can ask which transforms a
+props stanza uses, which props stanzas use a transform, and which names don't
+resolve, without each building their own dict of the transforms.
+
+Like Splunk, a stanza in local is merged over the same stanza in default, and
+a setting in local replaces the same setting in default, so a REPORT- that is
+overridden in local no longer references the transforms it did in default.
+
+    graph = reference_graph(app)
+    for reference in graph.referenced_by["my_transform"]:
+        ...
+"""
+import threading
+import weakref
+from .shared import _cleanup_regex, _settings_with_key_pattern
+
+# The transforms.conf settings kept for each transform, the rest are only
+# looked at to know the stanza exists
+TRANSFORM_SETTINGS = ("REGEX", "FORMAT", "DELIMS", "INGEST_EVAL")
+
+# The kinds of Reference that run at index time
+INDEX_TIME_KINDS = ("TRANSFORMS", "RULESET")
+
+
+class Transform:
+    """
+    A transforms.conf stanza, merged over default and local. definitions are
+    the (file_path, stanza) it is defined in, and settings are the (file_path,
+    stanza, setting) for each of TRANSFORM_SETTINGS it has.
+    """
+
+    __slots__ = ("name", "definitions", "settings")
+
+    def __init__(self, name):
+        self.name = name
+        self.definitions = []
+        self.settings = {}
+
+    def location(self):
+        """
+        (file_path, stanza, setting) to report the transform at, its REGEX if
+        it has one. setting is None if it has none of TRANSFORM_SETTINGS.
+        """
+        for name in TRANSFORM_SETTINGS:
+            if name in self.settings:
+                return self.settings[name]
+        file_path, stanza = self.definitions[0]
+        return file_path, stanza, None
+
+    def is_extraction(self):
+        """
+        Whether this extracts or rewrites something, rather than being a lookup
+        definition, which are used from searches and not props.conf.
+        """
+        return any(name in self.settings for name in ("REGEX", "DELIMS", "INGEST_EVAL"))
+
+
+class Reference:
+    """
+    One transform name in a REPORT-, TRANSFORMS- or RULESET- setting. kind is
+    REPORT, TRANSFORMS or RULESET.
+    """
+
+    __slots__ = ("kind", "name", "file_path", "stanza", "setting")
+
+    def __init__(self, kind, name, file_path, stanza, setting):
+        self.kind = kind
+        self.name = name
+        self.file_path = file_path
+        self.stanza = stanza
+        self.setting = setting
+
+
+class ReferenceGraph:
+    """
+    The transforms and the references to them from props.conf in an app.
+
+    transforms: transform name to Transform
+    references: every Reference, in the order they are in props.conf
+    referenced_by: transform name to the References to it, including names
+        that are not in transforms
+    uses: props.conf stanza name to its References
+    """
+
+    def __init__(self, app):
+        self.transforms = {}
+        self.references = []
+        self.referenced_by = {}
+        self.uses = {}
+        self._transforms_by_regex = None
+        self._lock = threading.Lock()
+        for file_path, stanza, setting in _settings_with_key_pattern(app, "transforms.conf", ""):
+            transform = self.transforms.get(stanza.name)
+            if transform is None:
+                transform = self.transforms[stanza.name] = Transform(stanza.name)
+            if not transform.definitions or transform.definitions[-1] != (file_path, stanza):
+                transform.definitions.append((file_path, stanza))
+            if setting.name in TRANSFORM_SETTINGS:
+                transform.settings[setting.name] = (file_path, stanza, setting)
+        # (stanza name, setting name) to the latest definition of the setting
+        props_settings = {}
+        for file_path, stanza, setting in _settings_with_key_pattern(app, "props.conf", "^(?:REPORT|TRANSFORMS|RULESET)-"):
+            props_settings[(stanza.name, setting.name)] = (file_path, stanza, setting)
+        for (file_path, stanza, setting) in props_settings.values():
+            kind = setting.name.split("-", 1)[0].upper()
+            for name in dict.fromkeys(name.strip() for name in setting.value.split(",")):
+                if name:
+                    reference = Reference(kind, name, file_path, stanza, setting)
+                    self.references.append(reference)
+                    self.referenced_by.setdefault(name, []).append(reference)
+                    self.uses.setdefault(stanza.name, []).append(reference)
+
+    def dangling(self):
+        """
+        The References to transforms that are not in transforms.conf.
+        """
+        return [reference for reference in self.references if reference.name not in self.transforms]
+
+    def unreferenced(self):
+        """
+        The extraction Transforms that no REPORT-, TRANSFORMS- or RULESET-
+        references.
+        """
+        return [transform for (name, transform) in self.transforms.items()
+                if transform.is_extraction() and name not in self.referenced_by]
+
+    def stanzas_using(self, name, kinds=None):
+        """
+        The names of the props.conf stanzas that reference the transform, with
+        kinds, such as INDEX_TIME_KINDS, to only count those references.
+        """
+        return list(dict.fromkeys(reference.stanza.name for reference in self.referenced_by.get(name, [])
+                                  if kinds is None or reference.kind in kinds))
+
+    def transforms_by_regex(self):
+        """
+        Cleaned up REGEX to the Transform with it. If several transforms have
+        the same regex, the last one wins, those are reported by
+        check_duplicate_transforms_regex.
+        """
+        with self._lock:
+            if self._transforms_by_regex is None:
+                self._transforms_by_regex = {}
+                for transform in self.transforms.values():
+                    if "REGEX" in transform.settings:
+                        regex = _cleanup_regex(transform.settings["REGEX"][2].value)
+                        self._transforms_by_regex[regex] = transform
+            return self._transforms_by_regex
+
+
+_graphs = weakref.WeakKeyDictionary()
+_graphs_lock = threading.Lock()
+
+
+def reference_graph(app):
+    """
+    The ReferenceGraph for the app, built the first time it is asked for and
+    shared by every check after that, including checks on other threads.
+    """
+    with _graphs_lock:
+        graph = _graphs.get(app)
+        if graph is None:
+            graph = _graphs[app] = ReferenceGraph(app)
+        return graph
@@ -0,0 +1,223 @@
+"""
+Persistent cache of regex analysis results, shared between runs.
+
+The same vendor regexes turn up across many apps and every CI run, but
+validity, dynamic field names, the cleaned up form and alternation complexity
+are worked out again each time. Set BEST_PRACTICES_REGEX_CACHE to the path of
+a SQLite database and shared.py keeps those results there, keyed by a hash of
+the analysis kind and regex, and the analyzer version.
+
+The database is in WAL mode, so parallel workers can all read it while one
+writes. Once the database is over BEST_PRACTICES_REGEX_CACHE_SIZE bytes
+(default 64MiB), the least recently used results are evicted, and the write
+ahead log is checkpointed before it grows past that size too.
+
+Inspect or prune it with:
+
+    python -m checks.regex_cache [--path PATH] stats
+    python -m checks.regex_cache [--path PATH] prune [--max-size BYTES] [--all]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Only rewrite last_used when a hit is older than this, so reads don't turn
+# into writes that block other workers
+TOUCH_AFTER = 24 * 60 * 60
+
+# Check the size of the cache after this many new results
+EVICT_EVERY = 100
+
+
+class RegexCache:
+    """
+    A SQLite cache of JSON analysis results, keyed by (kind, regex, version).
+    Each thread gets its own connection.
+    """
+
+    def __init__(self, path, max_size=64 * 1024 * 1024):
+        self.path = path
+        self.max_size = max_size
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.inserts = 0
+        with self._connection() as connection:
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS analysis (
+                    key TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    result TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )
+                """)
+            connection.execute("CREATE INDEX IF NOT EXISTS analysis_last_used ON analysis (last_used)")
+
+    def _connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            # Only takes effect on a new database, or after a VACUUM
+            connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            # Keep the WAL to max_size, it is only truncated to
+            # journal_size_limit once a checkpoint has emptied it
+            page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+            connection.execute(f"PRAGMA wal_autocheckpoint={max(1, min(1000, int(self.max_size) // page_size))}")
+            connection.execute(f"PRAGMA journal_size_limit={int(self.max_size)}")
+            self.local.connection = connection
+        return connection
+
+    @staticmethod
+    def key(kind, regex, version):
+        return hashlib.sha256(f"{kind}\0{version}\0{regex}".encode("utf-8")).hexdigest()
+
+    def get(self, kind, regex, version):
+        """
+        Returns (True, result) for a cached result, otherwise (False, None).
+        """
+        key = self.key(kind, regex, version)
+        connection = self._connection()
+        row = connection.execute("SELECT result, last_used FROM analysis WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return False, None
+        now = time.time()
+        if now - row[1] > TOUCH_AFTER:
+            with connection:
+                connection.execute("UPDATE analysis SET last_used = ? WHERE key = ?", (now, key))
+        return True, json.loads(row[0])
+
+    def put(self, kind, regex, version, result):
+        result = json.dumps(result)
+        key = self.key(kind, regex, version)
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO analysis (key, kind, version, result, size, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, kind, version, result, len(key) + len(kind) + len(result), time.time()))
+        with self.lock:
+            self.inserts += 1
+            evict = self.inserts % EVICT_EVERY == 0
+        if evict:
+            self.prune()
+
+    def stats(self):
+        """
+        Returns the number of results, and the size in bytes of their keys,
+        kinds and results, by kind and version. used_size has the size of the
+        whole database.
+        """
+        rows = self._connection().execute(
+            "SELECT kind, version, COUNT(*), COALESCE(SUM(size), 0) FROM analysis GROUP BY kind, version ORDER BY kind, version")
+        return [{"kind": kind, "version": version, "count": count, "size": size} for (kind, version, count, size) in rows]
+
+    def used_size(self, connection=None):
+        """
+        The bytes used by the database, every page of the results, the keys,
+        the index and SQLite's own overhead, less the free pages that have not
+        been vacuumed yet.
+        """
+        connection = connection or self._connection()
+        page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+        page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+        freelist_count = connection.execute("PRAGMA freelist_count").fetchone()[0]
+        return (page_count - freelist_count) * page_size
+
+    def prune(self, max_size=None, version=None, vacuum=False):
+        """
+        Deletes results for any version other than version, if given, then the
+        least recently used results until the database fits in max_size bytes
+        (default the cache's max_size). Free pages are handed back to the file
+        system and the WAL is truncated, and with vacuum the whole database is
+        rebuilt, which is slower but also compacts pages that are only partly
+        used. Returns the number deleted.
+        """
+        if max_size is None:
+            max_size = self.max_size
+        connection = self._connection()
+        deleted = 0
+        with connection:
+            if version is not None:
+                deleted += connection.execute("DELETE FROM analysis WHERE version != ?", (version,)).rowcount
+            used = self.used_size(connection)
+            if used > max_size:
+                # Results take a roughly even share of the pages, so evict down
+                # to 90% of that share, so we aren't evicting after every insert
+                count = connection.execute("SELECT COUNT(*) FROM analysis").fetchone()[0]
+                evict = count - int(count * max_size * 0.9 / used)
+                deleted += connection.execute(
+                    "DELETE FROM analysis WHERE key IN (SELECT key FROM analysis ORDER BY last_used, rowid LIMIT ?)",
+                    (evict,)).rowcount
+        if vacuum:
+            connection.execute("VACUUM")
+        else:
+            # The pragma frees one page each time it is stepped, and execute
+            # only steps a statement with no columns once, executescript runs
+            # it to completion
+            connection.executescript("PRAGMA incremental_vacuum")
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        return deleted
+
+    def clear(self):
+        connection = self._connection()
+        with connection:
+            return connection.execute("DELETE FROM analysis").rowcount
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def open_cache():
+    """
+    Returns the RegexCache at BEST_PRACTICES_REGEX_CACHE, or None if that is
+    not set.
+    """
+    path = os.environ.get("BEST_PRACTICES_REGEX_CACHE")
+    if not path:
+        return None
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = RegexCache(path, int(os.environ.get("BEST_PRACTICES_REGEX_CACHE_SIZE", 64 * 1024 * 1024)))
+        return _caches[path]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m checks.regex_cache", description="Inspect or prune the regex analysis cache.")
+    parser.add_argument("--path", default=os.environ.get("BEST_PRACTICES_REGEX_CACHE"),
+                        help="cache database, defaults to $BEST_PRACTICES_REGEX_CACHE")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="show the number and size of cached results")
+    prune = commands.add_parser("prune", help="evict results for old analyzer versions and least recently used ones")
+    prune.add_argument("--max-size", type=int, default=int(os.environ.get("BEST_PRACTICES_REGEX_CACHE_SIZE", 64 * 1024 * 1024)),
+                       help="size in bytes to prune the cache database to")
+    prune.add_argument("--all", action="store_true", help="delete everything")
+    args = parser.parse_args(argv)
+    if not args.path:
+        parser.error("no cache, set --path or BEST_PRACTICES_REGEX_CACHE")
+    cache = RegexCache(args.path)
+    if args.command == "stats":
+        total_count = total_size = 0
+        for row in cache.stats():
+            print(f"{row['kind']:<20} v{row['version']:<4} {row['count']:>10} results {row['size']:>12} bytes")
+            total_count += row["count"]
+            total_size += row["size"]
+        print(f"{'total':<26} {total_count:>10} results {total_size:>12} bytes")
+        print(f"{'database':<26} {'':>18} {cache.used_size():>12} bytes")
+    elif args.all:
+        print(f"Deleted {cache.clear()} results")
+        cache.prune(max_size=float("inf"), vacuum=True)
+    else:
+        from .shared import REGEX_ANALYZER_VERSION
+        print(f"Deleted {cache.prune(max_size=args.max_size, version=REGEX_ANALYZER_VERSION, vacuum=True)} results")
+
+
+if __name__ == "__main__":
+    main()
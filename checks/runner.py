@@ -0,0 +1,302 @@
+"""
+Runs the check_ functions for a single app concurrently.
+
+The checks are independent read-only passes over the app, but appinspect runs
+them one after another. run_checks runs them on a thread pool, or a process
+pool so the CPU heavy regex checks spread across cores. Each check writes to
+its own BufferedReporter, and these are replayed to the real reporter in the
+original order of the checks, so the output is the same as running them
+sequentially.
+
+    python -m checks.runner [--processes] [--workers N] [--output FORMAT] <app directory or archive>
+
+The output is one line per finding, as text or as NDJSON. For very large apps,
+--output aggregate has each check report into an AggregatingReporter instead,
+which groups the findings by level, file and message, so the output and the
+memory used stay bounded however many findings there are. Each line is written
+as soon as its check, and the checks before it, are done.
+"""
+import argparse
+import functools
+import importlib
+import json
+import os
+import sys
+import tarfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import regex as re
+
+# Modules with check_ functions, in the order they are run
+CHECK_MODULES = ["check_magic_eight", "check_regular_expressions", "check_search_performance",
+                 "check_transform_references", "check_stanza_patterns"]
+
+
+class BufferedReporter:
+    """
+    Records the calls to any reporter method, like warn and fail, to replay
+    them to another reporter later. rule is the name of the check.
+    """
+
+    def __init__(self, rule=None):
+        self.rule = rule
+        self.calls = []
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def record(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+        return record
+
+    def replay(self, reporter):
+        for (name, args, kwargs) in self.calls:
+            getattr(reporter, name)(*args, **kwargs)
+
+
+class AggregatingReporter:
+    """
+    Groups the calls to any reporter method by level, file and message, with
+    the stanza names in [...] taken out of the message, so thousands of
+    "SHOULD_LINEMERGE is not set for [...]" warnings become one finding with a
+    count. Each finding keeps the first few line numbers, and the stanza names
+    as ranges, like sourcetype_[00001-12000], so memory is bounded however many
+    times the check reports. Past max_findings, the rest are counted in one
+    "Other findings" finding for each level and file.
+    """
+
+    # A stanza name in a message, like "for [name]" or "[name]:EXTRACT-x", but
+    # not a character class in a regex in the message
+    stanza_pattern = re.compile(r"(?:^|(?<=[\s(]))\[(?<name>[^\[\]]+)\](?=$|[\s:,).])")
+    number_pattern = re.compile(r"(?<prefix>.*?)(?<number>\d+)")
+
+    def __init__(self, rule, examples=5, max_findings=100, max_ranges=10):
+        self.rule = rule
+        self.examples = examples
+        self.max_findings = max_findings
+        self.max_ranges = max_ranges
+        self.groups = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def record(message, file_name=None, line_number=None, *args, **kwargs):
+            self._add(name, message, file_name, line_number)
+        return record
+
+    def _add(self, level, message, file_name, line_number):
+        names = [m["name"] for m in self.stanza_pattern.finditer(message)]
+        template = self.stanza_pattern.sub("[<stanza>]", message)
+        key = (level, file_name, template)
+        if key not in self.groups and len(self.groups) >= self.max_findings:
+            key = (level, file_name, None)
+        finding = self.groups.get(key)
+        if finding is None:
+            finding = self.groups[key] = {
+                "rule": self.rule, "level": level, "file": file_name,
+                "message": template if key[2] is not None else "Other findings",
+                "count": 0, "lines": [], "stanzas": [], "more_stanzas": 0,
+            }
+        finding["count"] += 1
+        if line_number is not None and len(finding["lines"]) < self.examples:
+            finding["lines"].append(line_number)
+        for name in names:
+            self._add_stanza(finding, name)
+
+    def _add_stanza(self, finding, name):
+        """
+        Adds the stanza name to the finding's ranges, extending the last one
+        if the name is the next number after it.
+        """
+        m = self.number_pattern.fullmatch(name)
+        if m:
+            prefix, digits, number = m["prefix"], m["number"], int(m["number"])
+            # Only zero padded numbers have a fixed width
+            width = len(digits) if digits.startswith("0") else 0
+        else:
+            prefix, digits, number, width = name, None, None, 0
+        ranges = finding["stanzas"]
+        for r in ranges:
+            if r[0] != prefix or (r[1] is None) != (number is None):
+                continue
+            if number is None or (r[1] <= number <= r[2] and f"{number:0{r[3]}d}" == digits):
+                return
+        if ranges and number is not None:
+            last = ranges[-1]
+            if last[0] == prefix and last[2] == number - 1 and f"{number:0{last[3]}d}" == digits:
+                last[2] = number
+                return
+        if len(ranges) < self.max_ranges:
+            ranges.append([prefix, number, number, width])
+        else:
+            finding["more_stanzas"] += 1
+
+    @staticmethod
+    def _range(r):
+        (prefix, start, end, width) = r
+        if start is None:
+            return prefix
+        if start == end:
+            return f"{prefix}{start:0{width}d}"
+        return f"{prefix}[{start:0{width}d}-{end:0{width}d}]"
+
+    def findings(self):
+        """
+        The findings, in the order they were first reported, as dicts of rule,
+        level, file, message, count, lines and stanzas, and more_stanzas if
+        there were more than max_ranges ranges of stanzas.
+        """
+        for finding in self.groups.values():
+            finding = dict(finding, stanzas=[self._range(r) for r in finding["stanzas"]])
+            if not finding["more_stanzas"]:
+                del finding["more_stanzas"]
+            yield finding
+
+    def replay(self, reporter):
+        """
+        Reports each finding once, with its count, lines and stanzas in the
+        message, at its first line.
+        """
+        for finding in self.findings():
+            details = [f"{finding['count']} time{'s' if finding['count'] != 1 else ''}"]
+            if finding["lines"]:
+                details.append("lines " + ", ".join(str(line) for line in finding["lines"]) +
+                               (", ..." if finding["count"] > len(finding["lines"]) else ""))
+            if finding["stanzas"]:
+                details.append("stanzas " + ", ".join(finding["stanzas"]) +
+                               (f" and {finding['more_stanzas']} more" if finding.get("more_stanzas") else ""))
+            output = f"{finding['message']} ({'; '.join(details)})"
+            getattr(reporter, finding["level"])(output, finding["file"], finding["lines"][0] if finding["lines"] else None)
+
+
+def checks_in(module):
+    """
+    The check_ functions in the module, in the order they are defined.
+    """
+    return [value for (name, value) in vars(module).items() if name.startswith("check_") and callable(value)]
+
+
+def load_app(location):
+    """
+    An ArchiveApp for a .tgz/.spl archive, otherwise a splunk_appinspect App
+    for an app directory.
+    """
+    if os.path.isfile(location) and tarfile.is_tarfile(location):
+        from .archive_app import ArchiveApp
+        return ArchiveApp(location)
+    from splunk_appinspect.app import App
+    from splunk_appinspect.python_analyzer.trustedlibs.trusted_libs_manager import TrustedLibsManager
+    return App(location=location, trusted_libs_manager=TrustedLibsManager())
+
+
+def _parse_configs(app):
+    """
+    Parses the config files the checks use up front, so the checks share the
+    app's cached, read-only ConfigurationFiles rather than racing to parse
+    them.
+    """
+    for (config_file_name, method) in (("props.conf", "props_conf"), ("transforms.conf", "transforms_conf")):
+        if not hasattr(app, method):
+            continue
+        for directory in app.get_config_file_paths(config_file_name):
+            getattr(app, method)(directory)
+
+
+def _run_check(check, app, buffer):
+    reporter = buffer(check.__name__)
+    check(app, reporter)
+    return reporter
+
+
+# The app for each worker process, loaded once by _init_worker
+_worker_app = None
+
+
+def _init_worker(location):
+    global _worker_app
+    _worker_app = load_app(location)
+    _parse_configs(_worker_app)
+
+
+def _run_check_in_worker(module_name, check_name, buffer):
+    check = getattr(importlib.import_module(module_name), check_name)
+    return _run_check(check, _worker_app, buffer)
+
+
+def run_buffered(app, checks, buffer=BufferedReporter, workers=None, processes=False, location=None):
+    """
+    Runs the checks concurrently, each reporting to buffer(check name), and
+    yields those reporters in the order of checks, as soon as each one is
+    done. With processes, each worker loads the app from location itself,
+    since apps can't be shared between processes, and buffer has to be
+    picklable.
+
+    If a check raises, the reporters of the checks before it are yielded and
+    then the exception is raised, the same as a sequential run.
+    """
+    if processes:
+        if location is None:
+            raise ValueError("location is needed to run checks in processes")
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(location,)) as executor:
+            futures = [executor.submit(_run_check_in_worker, check.__module__, check.__name__, buffer) for check in checks]
+            for future in futures:
+                yield future.result()
+    else:
+        _parse_configs(app)
+        with ThreadPoolExecutor(workers) as executor:
+            futures = [executor.submit(_run_check, check, app, buffer) for check in checks]
+            for future in futures:
+                yield future.result()
+
+
+def run_checks(app, checks, reporter, workers=None, processes=False, location=None, aggregate=False):
+    """
+    Runs the checks concurrently and replays what they reported to reporter,
+    in the order of checks, see run_buffered. With aggregate, each check's
+    findings are grouped by an AggregatingReporter, and reported once per
+    group.
+    """
+    buffer = AggregatingReporter if aggregate else BufferedReporter
+    for buffered in run_buffered(app, checks, buffer, workers=workers, processes=processes, location=location):
+        buffered.replay(reporter)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m checks.runner", description="Run the best practices checks concurrently.")
+    parser.add_argument("location", help="app directory, or .tgz/.spl archive")
+    parser.add_argument("--workers", type=int, default=None, help="number of threads or processes")
+    parser.add_argument("--processes", action="store_true", help="run the checks in processes, not threads")
+    parser.add_argument("--output", choices=("text", "ndjson", "aggregate"), default="text",
+                        help="a line per finding as text or NDJSON, or NDJSON aggregated by rule, file and message")
+    parser.add_argument("--examples", type=int, default=5, help="line numbers to keep for each aggregated finding")
+    args = parser.parse_args(argv)
+    location = os.path.abspath(args.location)
+    app = None if args.processes else load_app(location)
+    checks = []
+    for module_name in CHECK_MODULES:
+        checks.extend(checks_in(importlib.import_module(f"{__package__}.{module_name}")))
+    if args.output == "aggregate":
+        buffer = functools.partial(AggregatingReporter, examples=args.examples)
+    else:
+        buffer = BufferedReporter
+    failed = False
+    for buffered in run_buffered(app, checks, buffer, workers=args.workers, processes=args.processes, location=location):
+        if args.output == "aggregate":
+            for finding in buffered.findings():
+                print(json.dumps(finding, separators=(",", ":")))
+                failed = failed or finding["level"] == "fail"
+            continue
+        for (name, call_args, _) in buffered.calls:
+            message, file_path, lineno = (list(call_args) + [None, None, None])[:3]
+            if args.output == "ndjson":
+                finding = {"rule": buffered.rule, "level": name, "file": file_path, "line": lineno, "message": message}
+                print(json.dumps(finding, separators=(",", ":")))
+            else:
+                print(f"{name.upper()}\t{file_path}:{lineno}\t{message}")
+            failed = failed or name == "fail"
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,14 @@
+import csv
+import io
 import os
 from splunk_appinspect.configuration_file import ConfigurationFile
 import regex as re
+from .conf_stream import ConfStream
+from .regex_cache import open_cache
+
+# Bump this when the result of any cached regex analysis changes, so results
+# from older versions in the regex cache are not used.
+REGEX_ANALYZER_VERSION = 1
 
 
 def _regex_valid_for_property(app, reporter, property_pattern):
@@ -8,31 +16,89 @@ def _regex_valid_for_property(app, reporter, property_pattern):
     Checks the regex for props.conf property that is expecting valid a valid
     regular expression.
     """
-    config_file_paths = app.get_config_file_paths("props.conf")
-    if config_file_paths:
-        for directory, filename in iter(config_file_paths.items()):
-            file_path = os.path.join(directory, filename)
-            config: ConfigurationFile = app.props_conf(directory)
-            for stanza in set(config.sections_with_setting_key_pattern(property_pattern)):
-                for setting in stanza.settings_with_key_pattern(property_pattern):
-                    _regex_valid(setting, reporter, file_path)
+    for file_path, stanza, setting in _settings_with_key_pattern(app, "props.conf", property_pattern):
+        _regex_valid(setting, reporter, file_path, stanza=stanza)
+
+
+def _settings_with_key_pattern(app, config_file_name, key_pattern):
+    """
+    Yields (file_path, stanza, setting) for each setting matching key_pattern
+    in the config file in default and local. Files of at least
+    BEST_PRACTICES_STREAM_SIZE bytes (default 1MiB) are streamed with
+    ConfStream, so memory stays bounded for very large generated files,
+    smaller ones use the app's parsed and cached ConfigurationFile.
+    """
+    config_file_paths = app.get_config_file_paths(config_file_name)
+    for directory, filename in iter(config_file_paths.items()):
+        file_path = os.path.join(directory, filename)
+        stream = _conf_stream(app, directory, filename)
+        if stream is not None:
+            for setting in stream.settings(key_pattern):
+                yield file_path, setting.stanza, setting
+        else:
+            # props_conf or transforms_conf, so we share the app's cache
+            config: ConfigurationFile = getattr(app, config_file_name.replace(".", "_"))(directory)
+            for stanza in config.sections():
+                for setting in stanza.settings_with_key_pattern(key_pattern):
+                    yield file_path, stanza, setting
+
+
+def _conf_stream(app, directory, filename):
+    """
+    Returns a ConfStream for the config file if it is big enough to be worth
+    streaming, otherwise None.
+    """
+    size = int(os.environ.get("BEST_PRACTICES_STREAM_SIZE", 1024 * 1024))
+    if hasattr(app, "conf_files"):
+        # An ArchiveApp, which already has the file in memory
+        data = app.conf_files[(directory, filename)]
+        return ConfStream(io.BytesIO(data)) if len(data) >= size else None
+    path = app.get_filename(directory, filename)
+    return ConfStream(path) if os.path.getsize(path) >= size else None
+
+
+def _cached(kind, regex, analyze):
+    """
+    Returns analyze(regex), from the regex cache if it is enabled. Results
+    have to survive a round trip through JSON, so use lists not tuples.
+    """
+    cache = open_cache()
+    if cache is None:
+        return analyze(regex)
+    found, result = cache.get(kind, regex, REGEX_ANALYZER_VERSION)
+    if not found:
+        result = analyze(regex)
+        cache.put(kind, regex, REGEX_ANALYZER_VERSION, result)
+    return result
 
 
-def _regex_valid(setting, reporter, file_path, regex=None):
+def _regex_valid(setting, reporter, file_path, regex=None, stanza=None):
     """
     Checks that the regex is valid, at least according to the regex library.
     Splunk's regex engine might have a different opinion. Try to capture those
-    differences here, and check for them, if possible.
+    differences here, and check for them, if possible. stanza is the setting's
+    stanza, for stanza level ignores.
     """
     if regex is None:
         regex = setting.value
-    try:
-        pattern = re.compile(regex)
-    except re.error:
+    analysis = _cached("valid", regex, _analyze_regex_valid)
+    if not analysis["valid"]:
         output = f"Regex {regex} is invalid in {setting.name}"
         reporter.fail(output, file_path, setting.lineno)
         return
+    if analysis["duplicate_names"]:
+        output = f"Duplicate named groups in {regex}"
+        reporter.fail(output, file_path, setting.lineno)
+    _large_alternation(setting, reporter, file_path, regex, stanza=stanza)
+
+
+def _analyze_regex_valid(regex):
+    try:
+        pattern = re.compile(regex)
+    except re.error:
+        return {"valid": False, "duplicate_names": False}
     # Named capture groups checks
+    duplicate_names = False
     if len(pattern.groupindex.keys()) > 0:
         # find duplicate named capture groups
         named_capture_pattern = re.compile(
@@ -44,9 +110,8 @@ def _regex_valid(setting, reporter, file_path, regex=None):
             >               # End of capture group name
             """, re.VERBOSE)
         groups = named_capture_pattern.findall(regex)
-        if len(groups) != len(set(groups)):
-            output = f"Duplicate named groups in {regex}"
-            reporter.fail(output, file_path, setting.lineno)
+        duplicate_names = len(groups) != len(set(groups))
+    return {"valid": True, "duplicate_names": duplicate_names}
 
 
 def _dynamic_field_names(setting, reporter, file_path):
@@ -57,16 +122,27 @@ def _dynamic_field_names(setting, reporter, file_path):
     some scenarios. TODO, this is valid in props.conf EXTRACT settings, but not
     sure about transforms REGEX setting.
     """
-    pattern = re.compile(setting.value)
+    for (level, rule_name, output) in _cached("dynamic_field_names", setting.value, _analyze_dynamic_field_names):
+        if rule_name and ignorable(setting, rule_name):
+            continue
+        getattr(reporter, level)(output, file_path, setting.lineno)
+
+
+def _analyze_dynamic_field_names(regex):
+    """
+    Returns the findings for _dynamic_field_names as [level, ignorable rule
+    name or None, output].
+    """
+    findings = []
+    pattern = re.compile(regex)
     key_val_pattern = re.compile(r"_(?<type>(?:KEY|VAL))_(?<id>.*)")
     groups = list(filter(key_val_pattern.match, pattern.groupindex))
     if len(groups) == 0:
         # Can't call not_applicable, since it will flag that for all of them as that
         pass
     elif len(groups) != len(pattern.groupindex.keys()):
-        if not ignorable(setting, "extra_capture_group"):
-            output = "Extra named capture group defined in regex with _KEY_ and _VAL_"
-            reporter.warn(output, file_path, setting.lineno)
+        output = "Extra named capture group defined in regex with _KEY_ and _VAL_"
+        findings.append(["warn", "extra_capture_group", output])
     else:
         for group in groups:
             m = key_val_pattern.match(group)
@@ -75,11 +151,12 @@ def _dynamic_field_names(setting, reporter, file_path):
             if type == "KEY":
                 if len(list(filter(lambda i: i == f"_VAL_{id}", groups))) != 1:
                     output = f"Have _KEY_{id}, could not find _VAL_{id}"
-                    reporter.fail(output, file_path, setting.lineno)
+                    findings.append(["fail", None, output])
             else:
                 if len(list(filter(lambda i: i == f"_KEY_{id}", groups))) != 1:
                     output = f"Have _VAL_{id}, could not find _KEY_{id}"
-                    reporter.fail(output, file_path, setting.lineno)
+                    findings.append(["fail", None, output])
+    return findings
 
 
 def _cleanup_regex(input):
@@ -88,6 +165,10 @@ def _cleanup_regex(input):
     regular expression. We also renumber _KEY_x and _VAL_x, so we can find
     duplicates easier that are in effect, the same regular expression.
     """
+    return _cached("cleanup", input, _analyze_cleanup_regex)
+
+
+def _analyze_cleanup_regex(input):
     pattern = re.compile(r"(?<!(?<!\\)\\)\(\?(P)<")
     regex = re.sub(pattern, "(?<", input)
     # These two regular expressions are effectively the same:
@@ -106,6 +187,392 @@ def _cleanup_regex(input):
     return regex
 
 
+# A quantifier after an atom, possibly lazy or possessive
+_QUANTIFIER = re.compile(r"(?:[*+?]|\{\d*(?:,\d*)?\})[?+]?")
+
+# The prefix of a group after the (, so its ? is not taken as a quantifier
+_GROUP_PREFIX = re.compile(r"\?(?:<[=!]|P?<\w+>|'\w+'|P=\w+|[:>|=!]|[a-zA-Z-]*:?)")
+
+
+def _regex_complexity(regex):
+    """
+    Static estimate of how expensive the regex is to match, or None if it is
+    invalid. Each atom is 1, each | is 1, each quantifier is 1 or 2 if it is
+    unbounded, each lookaround or backreference is 3, and an unbounded
+    quantifier on a group that has one inside, like (\\w+\\s*)+, is another 10
+    since that can backtrack catastrophically.
+    """
+    return _cached("complexity", regex, _analyze_regex_complexity)
+
+
+def _analyze_regex_complexity(regex):
+    try:
+        re.compile(regex)
+    except re.error:
+        return None
+    complexity = 0
+    # Whether each open group has an unbounded quantifier in it
+    unbounded_in = [False]
+    i = 0
+    while i < len(regex):
+        c = regex[i]
+        nested = False
+        if c == "\\":
+            escaped = regex[i + 1:i + 2]
+            complexity += 3 if escaped in ("k", "g") or (escaped.isdigit() and escaped != "0") else 1
+            i += 2
+        elif c == "[":
+            i += 1
+            if regex[i:i + 1] == "^":
+                i += 1
+            if regex[i:i + 1] == "]":
+                i += 1
+            while i < len(regex) and regex[i] != "]":
+                i += 2 if regex[i] == "\\" else 1
+            i += 1
+            complexity += 1
+        elif c == "(":
+            if regex.startswith(("(?=", "(?!", "(?<=", "(?<!"), i):
+                complexity += 3
+            unbounded_in.append(False)
+            m = _GROUP_PREFIX.match(regex, i + 1)
+            i = m.end() if m else i + 1
+            continue
+        elif c == ")":
+            nested = unbounded_in.pop() if len(unbounded_in) > 1 else False
+            i += 1
+        else:
+            # A literal, ., ^, $ or |
+            complexity += 1
+            i += 1
+        m = _QUANTIFIER.match(regex, i)
+        unbounded = bool(m) and (m.group()[0] in "*+" or re.match(r"\{\d*,\}", m.group()) is not None)
+        if m:
+            complexity += 2 if unbounded else 1
+            if unbounded and nested:
+                complexity += 10
+            i = m.end()
+        if unbounded or nested:
+            unbounded_in[-1] = True
+    return complexity
+
+
+def _capture_groups(regex):
+    """
+    Walks the source of a regex and finds each capture group. Returns a tuple
+    of a list of groups as [number, name, start, end], where name is None for
+    an unnamed group and regex[start:end] is the source of the group, and the
+    set of group numbers used by backreferences, conditionals or recursion.
+
+    Returns None if the regex uses something that would renumber the groups,
+    like a branch reset (?|...), since we can't tell which group is which.
+    """
+    named_group_start = re.compile(r"\(\?(?:P?<(?![=!])(?<name>\w+)>|'(?<name>\w+)')")
+    numbered_reference = re.compile(r"\(\?[+-]?(?<id>\d+)\)|\\g(?:<(?<id>\d+)>|\{(?<id>\d+)\}|(?<id>\d+))|\\(?<id>[1-9]\d?)")
+    conditional = re.compile(r"\(\?\((?<id>\d+)\)")
+    groups = []
+    references = set()
+    names = {}
+    count = 0
+    open_groups = []
+    in_class = False
+    i = 0
+    while i < len(regex):
+        m = numbered_reference.match(regex, i)
+        if m and not in_class:
+            references.add(int(m["id"]))
+            i = m.end()
+            continue
+        c = regex[i]
+        if c == "\\":
+            i += 2
+            continue
+        if in_class:
+            if c == "]":
+                in_class = False
+            i += 1
+            continue
+        if c == "[":
+            in_class = True
+            i += 1
+            # A ] straight after [ or [^ is a literal, not the end of the class
+            if regex.startswith("^", i):
+                i += 1
+            if regex.startswith("]", i):
+                i += 1
+            continue
+        if c == "(":
+            if regex.startswith("(?|", i):
+                return None
+            if regex.startswith("(?#", i):
+                end = regex.find(")", i)
+                i = len(regex) if end == -1 else end + 1
+                continue
+            m = named_group_start.match(regex, i)
+            if m:
+                name = m["name"]
+                if name not in names:
+                    count += 1
+                    names[name] = count
+                group = [names[name], name, i, None]
+            elif regex.startswith("(?", i):
+                m = conditional.match(regex, i)
+                if m:
+                    references.add(int(m["id"]))
+                    open_groups.append(None)
+                    i = m.end()
+                    continue
+                group = None
+            else:
+                count += 1
+                group = [count, None, i, None]
+            if group:
+                groups.append(group)
+            open_groups.append(group)
+        elif c == ")":
+            if open_groups:
+                group = open_groups.pop()
+                if group:
+                    group[3] = i + 1
+        i += 1
+    return groups, references
+
+
+def _unused_capture_groups(setting, reporter, file_path, stanza, format_setting=None):
+    """
+    Checks the capture groups of a regex are actually used. For a transforms.conf
+    REGEX, every unnamed capture group should be referenced by $n in FORMAT, and
+    every $n in FORMAT should exist in the REGEX. Named capture groups are
+    extracted straight to fields, so they are always used. If there is no
+    FORMAT we assume the default of <stanza name>::$1.
+
+    For a props.conf EXTRACT, only named capture groups create fields, so
+    format_setting should be left as None, and any unnamed capture group is
+    unused.
+
+    Unused capture groups still have to be captured on every match, so we
+    suggest the non-capturing (?:...) version of them.
+    """
+    regex = setting.value
+    try:
+        pattern = re.compile(regex)
+    except re.error:
+        # Invalid regexes are reported by the _regex_valid checks
+        return
+    named = set(pattern.groupindex.values())
+    unnamed = [n for n in range(1, pattern.groups + 1) if n not in named]
+    scanned = _capture_groups(regex)
+    sources = {}
+    references = set()
+    if scanned is not None:
+        groups, references = scanned
+        if len(set(g[0] for g in groups)) == pattern.groups:
+            sources = {g[0]: regex[g[2]:g[3]] for g in groups if g[1] is None and g[3]}
+    if setting.name.startswith("EXTRACT-"):
+        for n in unnamed:
+            if n in references:
+                continue
+            if not ignorable(setting, "unused_capture_group", stanza=stanza):
+                output = _unused_capture_group_output(n, sources.get(n), stanza, setting, "does not create a field")
+                reporter.warn(output, file_path, setting.lineno)
+        return
+    if format_setting is None:
+        format_references = {1}
+    else:
+        format_references = set(int(n) for n in re.findall(r"(?<!(?<!\\)\\)\$(\d+)", format_setting.value))
+        for n in sorted(format_references):
+            if n > pattern.groups:
+                output = f"FORMAT references ${n} but REGEX only has {pattern.groups} capture groups in [{stanza.name}]"
+                reporter.fail(output, file_path, format_setting.lineno)
+    if named and unnamed:
+        if not ignorable(setting, "mixed_capture_groups", stanza=stanza):
+            output = f"REGEX mixes named and unnamed capture groups in [{stanza.name}]"
+            reporter.warn(output, file_path, setting.lineno)
+    for n in unnamed:
+        if n in format_references or n in references:
+            continue
+        if not ignorable(setting, "unused_capture_group", stanza=stanza):
+            output = _unused_capture_group_output(n, sources.get(n), stanza, setting, "is not used by FORMAT")
+            reporter.warn(output, file_path, setting.lineno)
+
+
+def _unused_capture_group_output(n, source, stanza, setting, reason):
+    """
+    The same wording for unused capture groups in EXTRACT and REGEX, with the
+    group's source if we have it.
+    """
+    group = f"${n} {source}" if source else f"${n}"
+    suggestion = f"(?:{source[1:]}" if source else "(?:...)"
+    return f"Capture group {group} in [{stanza.name}]:{setting.name} {reason}, it could be non-capturing {suggestion}"
+
+
+# A single literal inside an alternation, anything that is not a regex
+# metacharacter, or an escaped punctuation character.
+_LITERAL = r"(?:[^\\()\[\]{}|.*+?^$]|\\[^A-Za-z0-9])+"
+
+
+def _large_alternation(setting, reporter, file_path, regex, stanza=None):
+    """
+    Checks for alternations of literals, like (foo|bar|baz|...), with at least
+    BEST_PRACTICES_ALTERNATION_SIZE (default 20) alternatives. Each alternative
+    is tried in turn at every position, so these are slow to match and are
+    better off as a lookup, or at least factored into a trie so common prefixes
+    are only matched once.
+
+    The warning has the estimated cost of both, and the trie factored regex if
+    it could be verified to match the same as the original. If
+    BEST_PRACTICES_LOOKUP_DIR is set, a CSV lookup skeleton of the literals is
+    written there as <stanza>.<setting>.<n>.csv, for the nth alternation in
+    the regex.
+    """
+    size = int(os.environ.get("BEST_PRACTICES_ALTERNATION_SIZE", 20))
+    if ignorable(setting, "large_alternation", stanza=stanza):
+        return
+    alternations = _cached(f"alternation:{size}", regex, lambda regex: _analyze_alternations(regex, size))
+    for (idx, alternation) in enumerate(alternations, 1):
+        output = (f"Alternation of {len(alternation['literals'])} literals in {setting.name} costs up to "
+                  f"{alternation['original_cost']} character comparisons per position "
+                  f"({alternation['factored_cost']} as a trie), consider a lookup")
+        if alternation["factored"]:
+            output += f" or {alternation['factored']}"
+        reporter.warn(output, file_path, setting.lineno)
+        lookup_dir = os.environ.get("BEST_PRACTICES_LOOKUP_DIR")
+        if lookup_dir:
+            with open(os.path.join(lookup_dir, _lookup_file_name(stanza, setting, idx)), "w", newline="") as fh:
+                writer = csv.writer(fh)
+                writer.writerow([alternation["field"]])
+                for literal in alternation["literals"]:
+                    writer.writerow([literal])
+
+
+def _lookup_file_name(stanza, setting, idx):
+    """
+    A file name for the lookup skeleton of the idx'th alternation in the
+    setting, unique in the app and safe on any file system.
+    """
+    parts = [stanza.name] if stanza is not None else []
+    parts.extend([setting.name, str(idx)])
+    return ".".join(re.sub(r"[^\w-]+", "_", part) for part in parts) + ".csv"
+
+
+def _analyze_alternations(regex, size):
+    """
+    Returns each alternation of at least size literals in the regex, with the
+    literals, the field name for a lookup, the costs, and the regex with the
+    alternation factored into a trie if it is equivalent.
+    """
+    alternations = []
+    alternation = re.compile(
+        r"""
+        (?<!(?<!\\)\\)\(                    # Start of a group, not escaped
+        (?:\?:|\?P?<(?<name>\w+)>|\?'(?<name>\w+)')?
+        (?<body>{literal}(?:\|{literal})+)  # Just literals separated by |
+        \)
+        """.replace("{literal}", _LITERAL), re.VERBOSE)
+    matches = list(alternation.finditer(regex))
+    if re.fullmatch(rf"{_LITERAL}(?:\|{_LITERAL})+", regex):
+        matches = [re.match(r"(?<body>.*)", regex, re.DOTALL)]
+    flags = re.match(r"\(\?[a-zA-Z]+\)", regex)
+    flags = flags.group() if flags else ""
+    for m in matches:
+        literals = list(dict.fromkeys(re.sub(r"\\(.)", r"\1", literal) for literal in re.findall(_LITERAL, m["body"])))
+        if len(literals) < size:
+            continue
+        factored = _trie_regex(literals)
+        if _equivalent_regex(flags + "(?:" + m["body"] + ")", flags + "(?:" + factored + ")", literals):
+            factored = regex[:m.start("body")] + factored + regex[m.end("body"):]
+        else:
+            factored = None
+        alternations.append({
+            "literals": literals,
+            "field": m.groupdict().get("name") or "value",
+            "original_cost": sum(len(literal) for literal in literals),
+            "factored_cost": _trie_cost(literals),
+            "factored": factored,
+        })
+    return alternations
+
+
+def _escape_literal(literal):
+    return "".join("\\" + c if c in "\\.^$*+?{}[]()|" else c for c in literal)
+
+
+def _trie_regex(literals, indexes=None):
+    """
+    Factors literals into a trie, so (foobar|foobaz|foo) becomes
+    foo(?:ba[rz])?. Alternations prefer the first alternative that matches, so
+    where a literal is a prefix of others the order is kept, with a lazy ?? if
+    the shorter literal came first. If the order can't be kept in the trie the
+    remaining suffixes are left as a plain alternation.
+    """
+    if indexes is None:
+        indexes = range(len(literals))
+    items = list(zip(literals, indexes))
+    ends = [i for (literal, i) in items if literal == ""]
+    rest = [(literal, i) for (literal, i) in items if literal != ""]
+    if not rest:
+        return ""
+    branches = {}
+    for (literal, i) in rest:
+        branches.setdefault(literal[0], []).append((literal[1:], i))
+    branches = sorted(branches.items(), key=lambda b: min(i for (_, i) in b[1]))
+    suffixes = [_trie_regex([s for (s, _) in b], [i for (_, i) in b]) for (_, b) in branches]
+    if len(branches) == 1:
+        body = _escape_literal(branches[0][0]) + suffixes[0]
+        atom = body if len(branches[0][0] + suffixes[0]) == 1 else f"(?:{body})"
+    elif not any(suffixes):
+        # Just single characters, so a character class will do
+        body = atom = "[" + "".join("\\" + c if c in "\\]^-" else c for (c, _) in branches) + "]"
+    else:
+        body = atom = "(?:" + "|".join(_escape_literal(c) + suffix for ((c, _), suffix) in zip(branches, suffixes)) + ")"
+    if not ends:
+        return body
+    if min(ends) < min(i for (_, i) in rest):
+        return atom + "??"
+    if min(ends) > max(i for (_, i) in rest):
+        return atom + "?"
+    return "(?:" + "|".join(_escape_literal(literal) for (literal, _) in sorted(items, key=lambda item: item[1])) + ")"
+
+
+def _trie_cost(literals):
+    """
+    Worst case number of character comparisons at each position for the trie
+    factored regex, trying every branch at each node on the longest path.
+    """
+    branches = {}
+    for literal in literals:
+        if literal:
+            branches.setdefault(literal[0], []).append(literal[1:])
+    if not branches:
+        return 0
+    return len(branches) + max(_trie_cost(rest) for rest in branches.values())
+
+
+def _equivalent_regex(original, factored, literals):
+    """
+    Checks the two regexes match the same thing, and prefer the same match, on
+    strings generated from the literals. Not a proof, but it catches mistakes
+    in factoring.
+    """
+    try:
+        original_pattern = re.compile(original)
+        factored_pattern = re.compile(factored)
+    except re.error:
+        return False
+    followers = sorted(set(literal[0] for literal in literals if literal)) + ["\n"]
+    for (idx, literal) in enumerate(literals):
+        tests = [literal, literal[:-1], literal + literals[(idx + 1) % len(literals)]]
+        tests.extend(literal + c for c in followers)
+        for test in tests:
+            if bool(original_pattern.fullmatch(test)) != bool(factored_pattern.fullmatch(test)):
+                return False
+            m1 = original_pattern.match(test)
+            m2 = factored_pattern.match(test)
+            if (m1 and m1.span()) != (m2 and m2.span()):
+                return False
+    return True
+
+
 def ignorable(setting, rule_names, stanza=None, config=None):
     """
     Is this item ignorable? Not all checks are ignorable. Currently only
@@ -129,17 +596,30 @@ def ignorable(setting, rule_names, stanza=None, config=None):
     From check_regular_expressions:
         extra_capture_group
         duplicate_regex
+        unused_capture_group
+        mixed_capture_groups
+        large_alternation
+
+    From check_search_performance:
+        kv_mode
+        indexed_extractions
+        automatic_lookup
+        eval_chain
+        search_performance (all of the above)
+
+    From check_transform_references:
+        dangling_transform
+        unreferenced_transform
+        hot_transform
+
+    From check_stanza_patterns:
+        overlapping_stanza
 
     These only apply to THESE app inspect checks. Not the ones provided by
     Splunk.
 
     You can also apply this to the stanza header to ignore it for all settings
     in the stanza.
-
-    WARNING: There is a bug in the config file parsing, where if the config file
-    lacks an ending newline, it does not have header (comment) information for
-    the setting or stanza. Please ensure your config file has a trailing new
-    line to end the file.
     """
     if type(rule_names) is tuple:
         checks = []
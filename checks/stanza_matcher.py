@@ -0,0 +1,340 @@
+"""
+Matches sources and hosts against the [source::...] and [host::...] stanzas in
+props.conf.
+
+Every stanza that matches an event's source or host applies to it, so a source
+that matches several overlapping stanzas pays for the settings of all of them.
+StanzaMatcher compiles the patterns of one kind into a combined matcher, to
+find the stanzas that apply to sample sources, in precedence order, and finds
+the patterns that overlap without needing any samples.
+
+The pattern syntax, from props.conf.spec:
+
+    ...   any number of characters, including /, so any number of directories,
+          and /.../ also matches just /
+    *     any number of characters except /
+    |     or, with ( ) to limit its scope
+    \\\\    a literal backslash
+
+Everything else is literal. When several stanzas of a kind match, the one with
+the highest priority setting takes precedence, which defaults to 100 for
+literal stanzas and 0 for patterns, then the one whose pattern comes first in
+ASCII order. source:: stanzas take precedence over host:: stanzas.
+
+The patterns are split into groups where no two patterns overlap, so at most
+one pattern in each group can match, and each group is compiled into a single
+regex. Matching a source is then one regex match per group, and one dict
+lookup for the literal stanzas. Patterns that overlap a lot, like .../a/...
+and .../b/..., end up in groups of their own, so those are only matched if
+the source contains their longest literal part. Results are also memoized,
+since samples repeat the same sources a lot.
+
+    python -m checks.stanza_matcher [--host] <app directory or archive> [<source> ...]
+
+prints the stanzas that apply to each source, or each line of stdin, in
+precedence order. With --overlaps it prints the overlapping stanzas instead.
+"""
+import argparse
+import itertools
+import sys
+import regex as re
+from .shared import _settings_with_key_pattern
+
+# A pattern with alternations expands to every combination of the
+# alternatives to find overlaps. Past this many, it is assumed to overlap
+# everything, so matches are still right, just slower.
+MAX_EXPANSIONS = 256
+
+# Results memoized before the memo is cleared
+MEMO_SIZE = 65536
+
+LITERAL_PRIORITY = 100
+PATTERN_PRIORITY = 0
+
+# Tokens in an expanded pattern, anything else is a literal character
+STAR = "*"
+ELLIPSIS = "..."
+
+
+def _parse(pattern):
+    """
+    Returns the regex for the pattern, and its expansions as lists of tokens,
+    or None for the expansions if there are more than MAX_EXPANSIONS.
+    """
+    regex, expansions, _ = _parse_alternation(pattern, 0, 0)
+    return regex, expansions
+
+
+def _parse_alternation(pattern, i, depth):
+    regexes = []
+    expansions = []
+    while True:
+        regex, sequence_expansions, i = _parse_sequence(pattern, i, depth)
+        regexes.append(regex)
+        if expansions is not None and sequence_expansions is not None:
+            expansions.extend(sequence_expansions)
+            if len(expansions) > MAX_EXPANSIONS:
+                expansions = None
+        else:
+            expansions = None
+        if i < len(pattern) and pattern[i] == "|":
+            i += 1
+            continue
+        return "|".join(regexes), expansions, i
+
+
+def _parse_sequence(pattern, i, depth):
+    regex = []
+    expansions = [[]]
+    # An unbalanced ) is just a literal
+    while i < len(pattern) and pattern[i] != "|" and not (depth and pattern[i] == ")"):
+        if pattern.startswith("/.../", i):
+            regex.append("/(?:.*/)?")
+            tokens = [["/", ELLIPSIS, "/"], ["/"]]
+            i += 5
+        elif pattern.startswith("...", i):
+            regex.append(".*")
+            tokens = [[ELLIPSIS]]
+            i += 3
+        elif pattern[i] == "*":
+            regex.append("[^/]*")
+            tokens = [[STAR]]
+            i += 1
+        elif pattern[i] == "(":
+            group_regex, tokens, i = _parse_alternation(pattern, i + 1, depth + 1)
+            if i < len(pattern) and pattern[i] == ")":
+                i += 1
+            regex.append(f"(?:{group_regex})")
+        elif pattern.startswith("\\\\", i):
+            regex.append(re.escape("\\"))
+            tokens = [["\\"]]
+            i += 2
+        else:
+            regex.append(re.escape(pattern[i]))
+            tokens = [[pattern[i]]]
+            i += 1
+        if expansions is not None and tokens is not None and len(expansions) * len(tokens) <= MAX_EXPANSIONS:
+            expansions = [expansion + token for (expansion, token) in itertools.product(expansions, tokens)]
+        else:
+            expansions = None
+    return "".join(regex), expansions, i
+
+
+def _is_literal(pattern):
+    return not re.search(r"\.\.\.|[*|()]|\\\\", pattern)
+
+
+def _literal_ends(tokens):
+    """
+    The literal characters before the first wildcard, and after the last.
+    """
+    wildcards = [i for (i, token) in enumerate(tokens) if token in (STAR, ELLIPSIS)]
+    if not wildcards:
+        return "".join(tokens), "".join(tokens)
+    return "".join(tokens[:wildcards[0]]), "".join(tokens[wildcards[-1] + 1:])
+
+
+def _required_literal(expansions):
+    """
+    The longest run of literal characters that any match of the pattern has
+    to contain, or "" if it doesn't have one, for a quick substring test
+    before the regex.
+    """
+    if expansions is None or len(expansions) != 1:
+        return ""
+    runs = "".join(token if token not in (STAR, ELLIPSIS) else "\0" for token in expansions[0]).split("\0")
+    return max(runs, key=len)
+
+
+def _overlap(a, b):
+    """
+    A string both expanded patterns match, or None if there isn't one. This is
+    a search of the product of the two patterns as automata, where a wildcard
+    either matches nothing and moves on, or matches a character the other
+    pattern has literally.
+    """
+    if ELLIPSIS not in a and STAR not in a and ELLIPSIS not in b and STAR not in b:
+        return "".join(a) if a == b else None
+    (a_prefix, a_suffix), (b_prefix, b_suffix) = _literal_ends(a), _literal_ends(b)
+    if not (a_prefix.startswith(b_prefix) or b_prefix.startswith(a_prefix)):
+        return None
+    if not (a_suffix.endswith(b_suffix) or b_suffix.endswith(a_suffix)):
+        return None
+    end = (len(a), len(b))
+    parents = {(0, 0): None}
+    queue = [(0, 0)]
+    for (i, j) in queue:
+        if (i, j) == end:
+            example = []
+            while parents[(i, j)] is not None:
+                (i, j), c = parents[(i, j)]
+                example.append(c)
+            return "".join(reversed(example))
+        x = a[i] if i < len(a) else None
+        y = b[j] if j < len(b) else None
+        moves = []
+        if x in (STAR, ELLIPSIS):
+            moves.append(((i + 1, j), ""))
+        if y in (STAR, ELLIPSIS):
+            moves.append(((i, j + 1), ""))
+        if x is not None and y is not None:
+            if x not in (STAR, ELLIPSIS) and y not in (STAR, ELLIPSIS):
+                if x == y:
+                    moves.append(((i + 1, j + 1), x))
+            elif x not in (STAR, ELLIPSIS):
+                if y == ELLIPSIS or x != "/":
+                    moves.append(((i + 1, j), x))
+            elif y not in (STAR, ELLIPSIS):
+                if x == ELLIPSIS or y != "/":
+                    moves.append(((i, j + 1), y))
+        for (state, c) in moves:
+            if state not in parents:
+                parents[state] = ((i, j), c)
+                queue.append(state)
+    return None
+
+
+class StanzaMatcher:
+    """
+    The source:: or host:: stanzas of props.conf, compiled to match against.
+    kind is source or host, and stanzas maps each pattern, without the
+    source:: or host:: prefix, to its priority setting, or None if it has
+    none.
+    """
+
+    def __init__(self, kind, stanzas):
+        self.kind = kind
+        self.priorities = {}
+        self.literals = set()
+        self.regexes = {}
+        self.expansions = {}
+        for (pattern, priority) in stanzas.items():
+            default = LITERAL_PRIORITY if _is_literal(pattern) else PATTERN_PRIORITY
+            try:
+                priority = int(priority) if priority is not None else default
+            except ValueError:
+                priority = default
+            self.priorities[pattern] = priority
+            if default == LITERAL_PRIORITY:
+                self.literals.add(pattern)
+                self.expansions[pattern] = [list(pattern)]
+            else:
+                self.regexes[pattern], self.expansions[pattern] = _parse(pattern)
+        # All the stanzas in precedence order, and just the patterns
+        self.stanzas = sorted(self.priorities, key=self._precedence)
+        self.patterns = [pattern for pattern in self.stanzas if pattern not in self.literals]
+        self._overlaps = {}
+        self.groups = []
+        for pattern in self.patterns:
+            for group in self.groups:
+                if not any(self._overlap(pattern, other) is not None for other in group):
+                    group.append(pattern)
+                    break
+            else:
+                self.groups.append([pattern])
+        self.compiled = []
+        indexes = {pattern: idx for (idx, pattern) in enumerate(self.patterns)}
+        for group in self.groups:
+            alternation = "|".join(f"(?:{self.regexes[pattern]})\\Z(?P<_{indexes[pattern]}>)" for pattern in group)
+            required = _required_literal(self.expansions[group[0]]) if len(group) == 1 else ""
+            self.compiled.append((required, re.compile(alternation, re.DOTALL).match))
+        self.names = {pattern: f"{kind}::{pattern}" for pattern in self.stanzas}
+        self.memo = {}
+
+    def _precedence(self, pattern):
+        return (-self.priorities[pattern], pattern)
+
+    def _overlap(self, a, b):
+        """
+        An example both patterns match, or None. Memoized, since grouping and
+        overlaps both need it. A pattern with too many expansions overlaps
+        everything, with no example.
+        """
+        key = (a, b) if a < b else (b, a)
+        if key not in self._overlaps:
+            if self.expansions.get(a) is None or self.expansions.get(b) is None:
+                self._overlaps[key] = ""
+            else:
+                self._overlaps[key] = next(
+                    (example for (x, y) in itertools.product(self.expansions[a], self.expansions[b])
+                     for example in (_overlap(x, y),) if example is not None), None)
+        return self._overlaps[key]
+
+    def match(self, value):
+        """
+        The names of the stanzas that apply to the source or host, like
+        source::/var/log/*.log, in precedence order.
+        """
+        result = self.memo.get(value)
+        if result is None:
+            matched = []
+            for (required, match) in self.compiled:
+                if required in value:
+                    m = match(value)
+                    if m:
+                        matched.append(self.patterns[int(m.lastgroup[1:])])
+            if value in self.literals:
+                matched.append(value)
+            if len(matched) > 1:
+                matched.sort(key=self._precedence)
+            result = tuple(self.names[pattern] for pattern in matched)
+            if len(self.memo) >= MEMO_SIZE:
+                self.memo.clear()
+            self.memo[value] = result
+        return result
+
+    def overlaps(self):
+        """
+        Yields (stanza, other stanza that takes precedence over it, example)
+        for every pair of overlapping stanzas. The example is a source or host
+        they both apply to, or None if the pattern was too complex to find one.
+        """
+        for (idx, pattern) in enumerate(self.stanzas):
+            for other in self.stanzas[:idx]:
+                example = self._overlap(pattern, other)
+                if example is not None:
+                    yield f"{self.kind}::{pattern}", f"{self.kind}::{other}", example or None
+
+
+def stanza_matchers(app):
+    """
+    Returns the StanzaMatcher for the source:: stanzas and host:: stanzas in
+    props.conf, and the (file_path, stanza) each stanza is first defined in.
+    """
+    stanzas = {"source": {}, "host": {}}
+    locations = {}
+    for file_path, stanza, setting in _settings_with_key_pattern(app, "props.conf", ""):
+        kind, separator, pattern = stanza.name.partition("::")
+        if not separator or kind not in stanzas:
+            continue
+        locations.setdefault(stanza.name, (file_path, stanza))
+        priorities = stanzas[kind]
+        if setting.name == "priority":
+            priorities[pattern] = setting.value
+        else:
+            priorities.setdefault(pattern, None)
+    return StanzaMatcher("source", stanzas["source"]), StanzaMatcher("host", stanzas["host"]), locations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m checks.stanza_matcher",
+                                     description="Show the source:: or host:: stanzas that apply to sources or hosts.")
+    parser.add_argument("location", help="app directory, or .tgz/.spl archive")
+    parser.add_argument("values", nargs="*", help="sources, or hosts with --host, read from stdin if none are given")
+    parser.add_argument("--host", action="store_true", help="match host:: stanzas rather than source:: stanzas")
+    parser.add_argument("--overlaps", action="store_true", help="show the overlapping stanzas instead")
+    args = parser.parse_args(argv)
+    from .runner import load_app
+    source_matcher, host_matcher, _ = stanza_matchers(load_app(args.location))
+    matcher = host_matcher if args.host else source_matcher
+    if args.overlaps:
+        for (stanza, other, example) in matcher.overlaps():
+            print(f"[{stanza}]\toverlaps [{other}]\t{example if example is not None else ''}")
+        return
+    values = args.values or (line.rstrip("\r\n") for line in sys.stdin)
+    for value in values:
+        print(f"{value}\t{' > '.join(matcher.match(value))}")
+
+
+if __name__ == "__main__":
+    main()
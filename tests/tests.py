@@ -1,10 +1,14 @@
 import unittest
 from unittest.mock import Mock
 from unittest.mock import call
+from unittest.mock import patch
 
 import os
 import sys
+import io
 import json
+import tarfile
+import tempfile
 from splunk_appinspect.app import App
 from splunk_appinspect.python_analyzer.trustedlibs.trusted_libs_manager import TrustedLibsManager
 
@@ -135,6 +139,64 @@ class TestCheckRegularExpressions(BaseTest):
         check_duplicate_extract(app, self.reporter)
         self.assert_mocked_calls(test_app)
 
+    def test_unused_capture_groups(self):
+        """
+        Tests REGEX and FORMAT capture groups in transforms.conf, and unnamed
+        capture groups in EXTRACT in props.conf.
+        """
+        from checks.check_regular_expressions import check_unused_capture_groups_transforms
+        from checks.check_regular_expressions import check_unused_capture_groups_props
+        test_app = "test_data/check_regular_expressions_capture_groups"
+        app = self.get_app(test_app)
+        check_unused_capture_groups_transforms(app, self.reporter)
+        check_unused_capture_groups_props(app, self.reporter)
+        self.assert_mocked_calls(test_app)
+
+    def test_large_alternation(self):
+        """
+        Tests alternations of many literals are flagged, with a trie factored
+        regex suggested.
+        """
+        from checks.check_regular_expressions import check_valid_regex_for_extract
+        from checks.check_regular_expressions import check_valid_regex_for_transforms
+        test_app = "test_data/check_regular_expressions_large_alternation"
+        app = self.get_app(test_app)
+        check_valid_regex_for_extract(app, self.reporter)
+        check_valid_regex_for_transforms(app, self.reporter)
+        self.assert_mocked_calls(test_app)
+
+    def test_large_alternation_lookup(self):
+        """
+        Tests the alternation size is configurable and a CSV lookup skeleton is
+        written when asked for.
+        """
+        from checks.check_regular_expressions import check_valid_regex_for_extract
+        app = self.get_app("test_data/check_regular_expressions_large_alternation")
+        with tempfile.TemporaryDirectory() as lookup_dir:
+            with patch.dict(os.environ, {"BEST_PRACTICES_ALTERNATION_SIZE": "4",
+                                         "BEST_PRACTICES_LOOKUP_DIR": lookup_dir}):
+                check_valid_regex_for_extract(app, self.reporter)
+            self.assertEqual(2, self.reporter.warn.call_count)
+            with open(os.path.join(lookup_dir, "bad.EXTRACT-small.1.csv")) as fh:
+                self.assertEqual("level\ndebug\ninfo\nwarn\nerror\n", fh.read().replace("\r\n", "\n"))
+
+    def test_large_alternation_lookups_per_stanza(self):
+        """
+        Each alternation gets its own lookup skeleton, named from the stanza,
+        the setting and the alternation, and stanzas can be ignored.
+        """
+        from checks.check_regular_expressions import check_valid_regex_for_transforms
+        app = self.get_app("test_data/check_regular_expressions_large_alternation_transforms")
+        with tempfile.TemporaryDirectory() as lookup_dir:
+            with patch.dict(os.environ, {"BEST_PRACTICES_LOOKUP_DIR": lookup_dir}):
+                check_valid_regex_for_transforms(app, self.reporter)
+            self.assertEqual(3, self.reporter.warn.call_count)
+            self.assertListEqual(["one.REGEX.1.csv", "one.REGEX.2.csv", "two.REGEX.1.csv"], sorted(os.listdir(lookup_dir)))
+            for (file_name, header) in (("one.REGEX.1.csv", ["user", "aa0"]), ("one.REGEX.2.csv", ["group", "cc0"]),
+                                        ("two.REGEX.1.csv", ["user", "bb0"])):
+                with open(os.path.join(lookup_dir, file_name)) as fh:
+                    self.assertListEqual(header, fh.read().splitlines()[:2])
+
 
 class TestCheckMagicEight(BaseTest):
     """
@@ -200,5 +262,385 @@ class TestCheckMagicEight(BaseTest):
         self.assert_mocked_calls(test_app)
 
 
+class TestCheckSearchPerformance(BaseTest):
+    """
+    Tests for the search time performance checks.
+    """
+
+    def test_clean(self):
+        """
+        This test checks things in test_data/check_search_performance_clean,
+        all the props.conf settings are clean for all the checks in
+        check_search_performance
+        """
+        from checks import check_search_performance
+        app = self.get_app("test_data/check_search_performance_clean")
+        for check_name in [c for c in dir(check_search_performance) if c.startswith("check_")]:
+            getattr(check_search_performance, check_name)(app, self.reporter)
+        self.assert_clean()
+
+    def test_dirty(self):
+        """
+        Test for KV_MODE, INDEXED_EXTRACTIONS, automatic lookups and EVAL
+        chains that slow down searches
+        """
+        from checks import check_search_performance
+        test_app = "test_data/check_search_performance_dirty"
+        app = self.get_app(test_app)
+        for check_name in [c for c in dir(check_search_performance) if c.startswith("check_")]:
+            getattr(check_search_performance, check_name)(app, self.reporter)
+        self.assert_mocked_calls(test_app)
+
+    def test_ignore(self):
+        """
+        Test the search performance warnings can be ignored
+        """
+        from checks import check_search_performance
+        app = self.get_app("test_data/check_search_performance_ignores")
+        for check_name in [c for c in dir(check_search_performance) if c.startswith("check_")]:
+            getattr(check_search_performance, check_name)(app, self.reporter)
+        self.assert_clean()
+
+    def test_high_volume_lookups(self):
+        """
+        Automatic lookups on high volume sourcetypes are flagged individually
+        """
+        from checks.check_search_performance import check_automatic_lookups
+        app = self.get_app("test_data/check_search_performance_clean")
+        with patch.dict(os.environ, {"BEST_PRACTICES_HIGH_VOLUME_SOURCETYPES": "go*"}):
+            check_automatic_lookups(app, self.reporter)
+        self.reporter.warn.assert_called_once_with(
+            "LOOKUP-geo is an automatic lookup on high volume [good], estimated relative cost 5 of 7",
+            "default/props.conf", 4)
+
+
+class TestCheckTransformReferences(BaseTest):
+    """
+    Tests for the props.conf to transforms.conf reference checks.
+    """
+
+    def test_references(self):
+        """
+        Test for dangling references, unreferenced transforms, including ones
+        only referenced from default when local overrides it, and hot index
+        time transforms ranked by regex complexity
+        """
+        from checks import check_transform_references
+        test_app = "test_data/check_transform_references"
+        app = self.get_app(test_app)
+        with patch.dict(os.environ, {"BEST_PRACTICES_HOT_TRANSFORM_STANZAS": "3",
+                                     "BEST_PRACTICES_EXTERNAL_TRANSFORMS": "splunk_*"}):
+            for check_name in [c for c in dir(check_transform_references) if c.startswith("check_")]:
+                getattr(check_transform_references, check_name)(app, self.reporter)
+        self.assert_mocked_calls(test_app)
+
+    def test_graph(self):
+        """
+        The graph is built once per app, and indexed both ways
+        """
+        from checks.reference_graph import INDEX_TIME_KINDS, reference_graph
+        app = self.get_app("test_data/check_transform_references")
+        graph = reference_graph(app)
+        self.assertIs(graph, reference_graph(app))
+        self.assertListEqual(["web", "web:error", "web:access", "source::/var/log/web/*.log"],
+                             graph.stanzas_using("set_index"))
+        self.assertListEqual(["web_fields", "route_nullqueue", "set_index"],
+                             [reference.name for reference in graph.uses["web:error"]])
+        self.assertListEqual(["web:proxy", "web:cdn"], graph.stanzas_using("size_eval", kinds=("RULESET",)))
+        self.assertListEqual([], graph.stanzas_using("web_fields", kinds=INDEX_TIME_KINDS))
+
+    def test_regex_complexity(self):
+        from checks.shared import _regex_complexity
+        self.assertEqual(3, _regex_complexity("abc"))
+        self.assertEqual(6, _regex_complexity(r"(?<x>\d+)\1"))
+        # Nested unbounded quantifiers cost a lot more
+        self.assertEqual(18, _regex_complexity(r"(\w+\s*)+"))
+        self.assertIsNone(_regex_complexity("("))
+
+
+class TestCheckStanzaPatterns(BaseTest):
+    """
+    Tests for the source:: and host:: stanza pattern checks and matcher.
+    """
+
+    def test_overlaps(self):
+        """
+        Test overlapping source:: and host:: stanzas are reported at the one
+        with lower precedence, unless they are ignored
+        """
+        from checks import check_stanza_patterns
+        test_app = "test_data/check_stanza_patterns"
+        app = self.get_app(test_app)
+        for check_name in [c for c in dir(check_stanza_patterns) if c.startswith("check_")]:
+            getattr(check_stanza_patterns, check_name)(app, self.reporter)
+        self.assert_mocked_calls(test_app)
+
+    def test_match(self):
+        """
+        Stanzas are matched in precedence order, priority first, then literal
+        over patterns, then ASCII order
+        """
+        from checks.stanza_matcher import StanzaMatcher
+        matcher = StanzaMatcher("source", {
+            "/var/log/*.log": None,
+            "/var/log/.../*.log": None,
+            "...": None,
+            "/var/log/(web|db)/*.log": "5",
+            "/var/log/web/error.log": None,
+        })
+        self.assertTupleEqual(("source::/var/log/web/error.log", "source::/var/log/(web|db)/*.log",
+                               "source::...", "source::/var/log/.../*.log"),
+                              matcher.match("/var/log/web/error.log"))
+        # * doesn't match /
+        self.assertTupleEqual(("source::...", "source::/var/log/.../*.log"), matcher.match("/var/log/web/app/x.log"))
+        self.assertTupleEqual(("source::...",), matcher.match("/var/log/app.txt"))
+        # /.../ also matches just /
+        self.assertIn("source::/var/log/.../*.log", matcher.match("/var/log/app.log"))
+        overlaps = [(name, other) for (name, other, _) in matcher.overlaps()]
+        self.assertIn(("source::/var/log/.../*.log", "source::/var/log/(web|db)/*.log"), overlaps)
+        self.assertNotIn(("source::/var/log/*.log", "source::/var/log/(web|db)/*.log"), overlaps)
+
+
+class TestConfStream(BaseTest):
+    """
+    Tests for the streaming .conf parser.
+    """
+
+    def test_headers_without_trailing_newline(self):
+        """
+        Header comments are kept for the last setting, even without a trailing
+        newline, and continuations are joined.
+        """
+        from checks.conf_stream import ConfStream
+        stream = ConfStream(io.BytesIO(b"# ignore magic8\n[one]\nA = 1 \\\n  2\n\n# ignore two\n[two]\n# ignore b\nB = 2"))
+        settings = list(stream.settings())
+        self.assertListEqual(["# ignore magic8"], stream.headers)
+        self.assertListEqual([("one", "A", "1 \n  2", 4, ()), ("two", "B", "2", 9, ("# ignore b",))],
+                             [(s.stanza.name, s.name, s.value, s.lineno, s.header) for s in settings])
+        self.assertTupleEqual(("", "# ignore two"), settings[1].stanza.header)
+
+    def test_parser_headers_without_trailing_newline(self):
+        """
+        The app's own parser keeps them too, so ignores work in files that are
+        not streamed.
+        """
+        from splunk_appinspect import configuration_parser
+        from splunk_appinspect.configuration_file import ConfigurationFile
+        config = configuration_parser.parse(io.BytesIO(b"[one]\nA = 1\n\n# ignore two\n[two]\n# ignore b\nB = 2"),
+                                            ConfigurationFile(), configuration_parser.configuration_lexer)
+        self.assertListEqual(["", "# ignore two"], list(config.get_section("two").header))
+        self.assertListEqual(["# ignore b"], list(config.get_section("two").get_option("B").header))
+
+    def test_streamed_checks(self):
+        """
+        Checks give the same results when the config files are streamed.
+        """
+        from checks.check_regular_expressions import check_valid_regex_for_extract
+        test_app = "test_data/check_regular_expressions_valid_regex"
+        app = self.get_app(test_app)
+        with patch.dict(os.environ, {"BEST_PRACTICES_STREAM_SIZE": "0"}):
+            check_valid_regex_for_extract(app, self.reporter)
+        with open(os.path.join(test_path, test_app, "expected.json")) as fh:
+            expected = [c for c in json.load(fh) if c[1][1] == "default/props.conf"]
+        calls = json.loads(json.dumps(self.reporter.mock_calls))
+        self.assertListEqual(sorted(expected), sorted(calls))
+
+
+class TestRegexCache(BaseTest):
+    """
+    Tests for the persistent regex analysis cache.
+    """
+
+    def test_cached_results(self):
+        """
+        A second run gets the same results from the cache.
+        """
+        from checks.check_regular_expressions import check_valid_regex_for_extract
+        from checks.check_regular_expressions import check_valid_regex_for_transforms
+        from checks.regex_cache import open_cache
+        test_app = "test_data/check_regular_expressions_valid_regex"
+        app = self.get_app(test_app)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with patch.dict(os.environ, {"BEST_PRACTICES_REGEX_CACHE": os.path.join(cache_dir, "cache.sqlite")}):
+                for _ in range(2):
+                    self.reporter.reset_mock()
+                    check_valid_regex_for_extract(app, self.reporter)
+                    check_valid_regex_for_transforms(app, self.reporter)
+                    self.assert_mocked_calls(test_app)
+                stats = open_cache().stats()
+        self.assertListEqual([("alternation:20", 3), ("valid", 5)], [(row["kind"], row["count"]) for row in stats])
+
+    def test_prune(self):
+        """
+        Pruning evicts old analyzer versions and the least recently used results.
+        """
+        from checks.regex_cache import RegexCache
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = RegexCache(os.path.join(cache_dir, "cache.sqlite"))
+            cache.put("cleanup", "old", 0, "old")
+            cache.put("cleanup", "a", 1, "a")
+            cache.put("cleanup", "b", 1, "b")
+            self.assertEqual(1, cache.prune(version=1))
+            self.assertTupleEqual((False, None), cache.get("cleanup", "old", 0))
+            self.assertEqual(2, cache.prune(max_size=0))
+            self.assertTupleEqual((False, None), cache.get("cleanup", "b", 1))
+
+    def test_prune_size(self):
+        """
+        The whole database, not just the results, is kept to the max size, and
+        pruning hands the space back to the file system, both the automatic
+        prune on put and an explicit one, with or without a vacuum.
+        """
+        from checks.regex_cache import RegexCache
+        result = {"valid": True, "duplicate_names": False}
+        with tempfile.TemporaryDirectory() as cache_dir:
+            path = os.path.join(cache_dir, "cache.sqlite")
+            cache = RegexCache(path, max_size=100000)
+            for i in range(20000):
+                cache.put("valid", f"regex{i}", 1, result)
+            self.assertLessEqual(os.path.getsize(path), 150000)
+            self.assertLessEqual(os.path.getsize(path + "-wal"), 150000)
+            cache.prune(vacuum=True)
+            self.assertLessEqual(os.path.getsize(path), 100000)
+            self.assertLessEqual(cache.used_size(), 100000)
+            self.assertTupleEqual((True, result), cache.get("valid", "regex19999", 1))
+            self.assertTupleEqual((False, None), cache.get("valid", "regex0", 1))
+
+            path = os.path.join(cache_dir, "large.sqlite")
+            cache = RegexCache(path, max_size=10 * 1024 * 1024)
+            for i in range(20000):
+                cache.put("valid", f"regex{i}", 1, result)
+            self.assertGreater(os.path.getsize(path), 1000000)
+            cache.prune(max_size=100000)
+            self.assertLessEqual(os.path.getsize(path), 150000)
+            self.assertEqual(0, os.path.getsize(path + "-wal"))
+
+
+class TestArchiveApp(BaseTest):
+    """
+    Tests for running the checks against an app archive without extracting it.
+    """
+
+    def make_archive(self, location, archive_dir):
+        archive = os.path.join(archive_dir, "app.tgz")
+        with tarfile.open(archive, "w:gz") as tar:
+            tar.add(os.path.join(test_path, location), arcname="app")
+            data = b"\0" * 1024
+            info = tarfile.TarInfo("app/bin/bundled.bin")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        return archive
+
+    def test_only_conf_files(self):
+        """
+        Only the default/*.conf and local/*.conf files are kept.
+        """
+        from checks.archive_app import ArchiveApp
+        with tempfile.TemporaryDirectory() as archive_dir:
+            app = ArchiveApp(self.make_archive("test_data/check_regular_expressions_duplicates", archive_dir))
+        self.assertListEqual([("default", "props.conf"), ("default", "transforms.conf")],
+                             sorted(app.conf_files.keys()))
+        self.assertDictEqual({"default": "props.conf"}, app.get_config_file_paths("props.conf"))
+        self.assertDictEqual({}, app.get_config_file_paths("inputs.conf"))
+
+    def test_checks_on_archive(self):
+        """
+        Checks give the same results on the archive as on the app directory.
+        """
+        from checks.archive_app import ArchiveApp
+        from checks import check_magic_eight
+        test_app = "test_data/check_magic_eight_dirty"
+        with tempfile.TemporaryDirectory() as archive_dir:
+            app = ArchiveApp(self.make_archive(test_app, archive_dir))
+        for check_name in [c for c in dir(check_magic_eight) if c.startswith("check_")]:
+            getattr(check_magic_eight, check_name)(app, self.reporter)
+        self.assert_mocked_calls(test_app)
+
+
+class TestRunner(BaseTest):
+    """
+    Tests for running the checks concurrently.
+    """
+
+    def run_sequentially(self, app, checks):
+        reporter = Mock()
+        for check in checks:
+            check(app, reporter)
+        return reporter.mock_calls
+
+    def all_checks(self):
+        import importlib
+        from checks import runner
+        checks = []
+        for module_name in runner.CHECK_MODULES:
+            checks.extend(runner.checks_in(importlib.import_module(f"checks.{module_name}")))
+        return checks
+
+    def test_same_order_as_sequential(self):
+        """
+        Threaded runs report exactly the same calls, in the same order, as
+        running the checks one after another.
+        """
+        from checks import runner
+        checks = self.all_checks()
+        for test_app in ["test_data/check_magic_eight_dirty", "test_data/check_regular_expressions_duplicates",
+                         "test_data/check_search_performance_dirty"]:
+            app = self.get_app(test_app)
+            expected = self.run_sequentially(app, checks)
+            reporter = Mock()
+            runner.run_checks(self.get_app(test_app), checks, reporter, workers=4)
+            self.assertListEqual(expected, reporter.mock_calls)
+
+    def test_aggregate(self):
+        """
+        Findings are grouped by level, file and message without the stanza
+        names, with counts, the first few lines, and stanza name ranges
+        """
+        from checks.runner import AggregatingReporter
+        reporter = AggregatingReporter("check_example", examples=3, max_findings=2, max_ranges=3)
+        for i in range(1, 1001):
+            reporter.warn(f"TRUNCATE is not set for [sourcetype_{i:04d}]", "default/props.conf", i * 3)
+        reporter.warn("TRUNCATE is not set for [web]", "default/props.conf", 3001)
+        reporter.warn("TRUNCATE is not set for [web]", "default/props.conf", 3002)
+        reporter.warn("TRUNCATE is not set for [st9]", "default/props.conf", 3003)
+        reporter.warn("TRUNCATE is not set for [st10]", "default/props.conf", 3004)
+        reporter.fail("Regex ([a-z]+ is invalid in EXTRACT-x", "default/props.conf", 5)
+        reporter.fail("Regex ([0-9]+ is invalid in EXTRACT-y", "default/props.conf", 6)
+        self.assertListEqual([
+            {"rule": "check_example", "level": "warn", "file": "default/props.conf",
+             "message": "TRUNCATE is not set for [<stanza>]", "count": 1004, "lines": [3, 6, 9],
+             "stanzas": ["sourcetype_[0001-1000]", "web", "st[9-10]"]},
+            {"rule": "check_example", "level": "fail", "file": "default/props.conf",
+             "message": "Regex ([a-z]+ is invalid in EXTRACT-x", "count": 1, "lines": [5], "stanzas": []},
+            {"rule": "check_example", "level": "fail", "file": "default/props.conf",
+             "message": "Other findings", "count": 1, "lines": [6], "stanzas": []},
+        ], list(reporter.findings()))
+        reporter.warn("TRUNCATE is not set for [other]", "default/props.conf", 3005)
+        self.assertEqual(1, list(reporter.findings())[0]["more_stanzas"])
+
+    def test_run_aggregated(self):
+        """
+        Aggregated findings are reported once each, at their first line
+        """
+        from checks import runner
+        from checks import check_magic_eight
+        app = self.get_app("test_data/check_magic_eight_dirty")
+        runner.run_checks(app, [check_magic_eight.check_truncate], self.reporter, aggregate=True)
+        self.assertListEqual([
+            call.warn("TRUNCATE is not set for [<stanza>] (1 time; lines 1; stanzas bad1)", "default/props.conf", 1)
+        ], self.reporter.mock_calls[:1])
+
+    def test_processes(self):
+        """
+        Each worker process loads the app itself.
+        """
+        from checks import runner
+        from checks import check_magic_eight
+        test_app = "test_data/check_magic_eight_dirty"
+        runner.run_checks(None, runner.checks_in(check_magic_eight), self.reporter, workers=2, processes=True,
+                          location=os.path.join(test_path, test_app))
+        self.assert_mocked_calls(test_app)
+
+
 if __name__ == '__main__':
     unittest.main()